@@ -1,10 +1,21 @@
 #!/bin/python3
 
 import json
+import re
 import requests
 import importlib
 import time
 import os
+import random
+import hashlib
+import threading
+import collections
+import collections.abc
+import concurrent.futures
+import email.utils
+
+import time_helper
+import json_codec
 
 class Api_helper:
     def __init__(self, db_helper, config):
@@ -14,7 +25,6 @@ class Api_helper:
         self.api_key = config.api_key
         self.wait_s = config.wait_ms / 1000.0
         self.retry_limit = config.retry_limit
-        self.last_request = time.time() - self.wait_s
 
         self.client = requests.Session()
 
@@ -24,26 +34,81 @@ class Api_helper:
         self.client.headers.update({'x-api-key': self.api_key})
         self.client.headers.update({'Authorization': 'OAuth'})
         self.client.headers.update({'X-Twitch-Id': ''})
-    
-    def get_retry(self, url, retries=0):
+
+        # one limiter shared by every worker, wait_ms is a global rate rather than a gap
+        self.limiter = Token_bucket(1.0 / self.wait_s if self.wait_s > 0 else 0)
+        self.rate = Rate_controller(self.limiter, config.max_rate, config.rate_step)
+        self.engine = Request_engine(self, config.concurrency)
+
+        # pipeline stages bring their own request threads, one more posts latest files
+        pool_size = max(config.concurrency, 1)
+        if config.pipeline:
+            pool_size += config.pipeline_files + config.pipeline_texts + 1
+
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.client.mount('http://', adapter)
+        self.client.mount('https://', adapter)
+
+    def close(self):
+        self.engine.shutdown()
+
+    def get_retry(self, url, retries=0, body=None):
+        while True:
+            waited = self.limiter.acquire()
+
+            if waited > 0:
+                print('Making request to: ' + url + ' Waited for ' + self.format_ms(waited * 1000) + 'ms', flush=True)
+            else:
+                print('Making request to: ' + url, flush=True)
+
+            delay = self.rate.backoff(retries)
+
+            try:
+                # per call, workers share this helper
+                request_time = time.time()
+                if body is None:
+                    r = self.client.get(self.api_url + url)
+                else:
+                    r = self.client.post(self.api_url + url, json=body)
+                r.request_time = request_time
+                print('Got response: ' + str(r.status_code) + ' ' + url)
+            except requests.RequestException as e:
+                print('Request failed: ' + url)
+                print(e)
+                if retries >= self.retry_limit:
+                    raise
+            else:
+                if r.status_code not in retry_status:
+                    self.rate.success()
+                    return r
+
+                if r.status_code in throttle_status:
+                    retry_after = self.retry_after(r)
+                    self.rate.throttled(retry_after)
+                    delay = max(delay, retry_after)
+
+                if retries >= self.retry_limit:
+                    return r
+
+            retries += 1
+            print('Retrying request attempt: ' + str(retries) + ' in ' + self.format_ms(delay * 1000) + 'ms ' + url)
+            time.sleep(delay)
+
+    def retry_after(self, r):
+        # seconds or an http date, missing means no hint
+        value = r.headers.get('Retry-After')
+        if not value:
+            return 0
+
+        try:
+            return max(0, float(value))
+        except ValueError:
+            pass
+
         try:
-            print('Making request to: ' + url, end=' ', flush=True)
-
-            if (self.last_request + self.wait_s) > time.time():
-                ms = (self.last_request + self.wait_s) - time.time()
-                print('Waiting for ' + self.format_ms(ms) + 'ms', end=' ', flush=True)
-                time.sleep(ms)
-
-            self.last_request = time.time()
-            r = self.client.get(self.api_url + url)
-            print('Got response: ' + str(r.status_code))
-            return r
-        except:
-            print('Request failed')
-            if retries > self.retry_limit:
-                raise
-            print('Retrying request attempt: ' + str(retries + 1))
-            return self.get_retry(url, retries + 1)
+            return max(0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return 0
 
     def write_file(self, path, data :str):
         os.makedirs(os.path.dirname(path), exist_ok=True)
@@ -54,43 +119,99 @@ class Api_helper:
         self.write_file(path, json.dumps(data, indent=4))
 
     def get_json(self, url, write=False, use_local=False, time_diff=3600):
+        return self.submit_json(url, write, use_local, time_diff).result()
+
+    def request_key(self, url, body=None):
+        # post requests are cached under the url and a hash of the body
+        if body is None:
+            return url
+
+        return url + '#' + hashlib.sha1(json.dumps(body, sort_keys=True).encode()).hexdigest()
+
+    def submit_json(self, url, write=False, use_local=False, time_diff=3600, body=None, engine=None):
+        # cache lookups stay on the calling thread, only the http request is handed to the engine
+        key = self.request_key(url, body)
         _cache = self.config.cache_option
         _store = self.config.store_option
 
         _use = (use_local and _cache == 'default') or _cache not in ['none','default']
         _write = (write and _store == 'default') or _store not in ['none', 'default']
 
-        if _use and _cache != 'only':
-            _use = not self.should_update_entries(url, time_diff)
+        if _use:
+            # freshness comes from the in-memory request cache or one indexed lookup
+            last = self.db.last_request(key)
+
+            if _cache != 'only':
+                _use = not self.should_update_entries(key, time_diff, last[0] if last else 0)
 
         if _use:
             try:
-                return json.loads(self.db.get_request(url))
+                return Pending_json(self, key, data=Raw_json(self.db.get_content(last[1])))
             except Exception as e:
-                print('Failed to read local database: ' + url)
+                print('Failed to read local database: ' + key)
                 print(e)
                 pass
 
         if _cache == 'only':
             print("Cached requests only")
-            return None
+            return Pending_json(self, key)
 
-        json_data = self.get_retry(url).json()
+        if engine is None:
+            engine = self.engine
 
-        if _write:
-            self.db.insert_request(url, json_data, self.last_request)
+        return Pending_json(self, key, _write, engine.submit(url, body))
 
-        return json_data
+    def as_completed(self, pending):
+        # yield pending requests as they finish, cached entries first
+        waiting = {}
+        for p in pending:
+            if p.future is None:
+                yield p
+            else:
+                waiting[p.future] = p
+
+        for future in concurrent.futures.as_completed(waiting):
+            yield waiting[future]
+
+    def collect(self, pending):
+        # drain pending requests so they are stored, failures are only reported
+        for p in self.as_completed(pending):
+            try:
+                p.result()
+            except Exception as e:
+                print('Request failed: ' + p.url)
+                print(e)
+
+    def iterate_batches(self, url, key, ids, batch_size=None, write=True):
+        # post ids in batches through the engine, (batch, result) is yielded in order while later batches are in flight
+        # a failed batch yields None so the caller knows which ids are missing
+        if batch_size is None:
+            batch_size = self.config.batch_size
+
+        window = max(self.config.concurrency, 1) * 2
+        batches = collections.deque(ids[i:i + batch_size] for i in range(0, len(ids), batch_size))
+        waiting = collections.deque()
+
+        while batches or waiting:
+            while batches and len(waiting) < window:
+                batch = batches.popleft()
+                waiting.append((batch, self.submit_json(url, write, False, 0, {key: batch})))
+
+            batch, pending = waiting.popleft()
+            try:
+                yield batch, pending.result()
+            except Exception as e:
+                print('Request failed: ' + pending.url)
+                print(e)
+                yield batch, None
 
     def when_last_request(self, url):
-        if not self.db.request_exists(url):
-            return 0
-        
-        self.db.cur.execute('SELECT * FROM (SELECT time FROM api WHERE url=?) ORDER BY time DESC LIMIT 1', (url,))
-        return self.db.cur.fetchone()[0]
+        return self.db.when_last_request(url)
+
+    def should_update_entries(self, url, time_diff, req_time=None):
+        if req_time is None:
+            req_time = self.when_last_request(url)
 
-    def should_update_entries(self, url, time_diff):
-        req_time = self.when_last_request(url)
         now_time = time.time()
         res = req_time + time_diff < now_time
         leftover = (now_time - req_time) - time_diff
@@ -108,17 +229,233 @@ class Api_helper:
         return f'{ms:.3f}'
 
     def read_time(self, stime):
-        try:
-            return time.mktime(time.strptime(stime, '%Y-%m-%dT%H:%M:%S.%fZ'))
-        except:
+        return time_helper.parse_time(stime)
+
+
+retry_status = [429, 500, 502, 503, 504]
+throttle_status = [429, 503]
+
+class Token_bucket:
+    def __init__(self, rate, capacity=1):
+        # rate in tokens per second, a rate of 0 disables the limit
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = rate
+
+    def pause(self, seconds):
+        # no tokens are handed out until the pause ends
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+    def acquire(self):
+        waited = 0
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = self.paused_until - now
+
+                if wait <= 0 and self.rate <= 0:
+                    return waited
+
+                if wait <= 0:
+                    self.tokens = min(self.capacity, self.tokens + (now - max(self.last, self.paused_until)) * self.rate)
+                    self.last = now
+
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+
+                    wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+
+class Rate_controller:
+    # additive increase while responses are healthy, multiplicative decrease when throttled
+    def __init__(self, limiter, max_rate=0, step=0.05, decrease=0.5, min_rate=0.05, backoff_base=1, backoff_cap=120):
+        self.limiter = limiter
+        self.initial_rate = limiter.rate
+        self.max_rate = max_rate if max_rate and max_rate > 0 else limiter.rate
+        self.step = step
+        self.decrease = decrease
+        self.min_rate = min_rate
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.last_decrease = 0
+        self.lock = threading.Lock()
+
+    def success(self):
+        with self.lock:
+            rate = self.limiter.rate
+            if 0 < rate < self.max_rate:
+                self.limiter.set_rate(min(self.max_rate, rate + self.step))
+
+    def throttled(self, retry_after=0):
+        with self.lock:
+            if retry_after:
+                self.limiter.pause(retry_after)
+
+            # requests already in flight get throttled together, cut once per window
+            now = time.monotonic()
+            if now - self.last_decrease < max(1, retry_after):
+                return
+
+            self.last_decrease = now
+            rate = self.limiter.rate
+            if rate <= 0:
+                rate = self.max_rate if self.max_rate > 0 else 1
+
+            rate = max(self.min_rate, rate * self.decrease)
+            self.limiter.set_rate(rate)
+            print(f'Throttled, request rate now {rate:.3f}/s' + (f', pausing for {retry_after:.3f}s' if retry_after else ''), flush=True)
+
+    def backoff(self, retries):
+        # full jitter exponential backoff
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** retries))
+
+
+class Request_engine:
+    def __init__(self, api, workers=1):
+        self.api = api
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='request')
+
+    def submit(self, url, body=None):
+        return self.executor.submit(self.api.get_retry, url, 0, body)
+
+    def shutdown(self, wait=False):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+
+class Pending_json:
+    def __init__(self, api, url, write=False, future=None, data=None):
+        self.api = api
+        self.url = url
+        self.write = write
+        self.future = future
+        self.data = data
+
+    def done(self):
+        return self.future is None or self.future.done()
+
+    def cancel(self):
+        return self.future is not None and self.future.cancel()
+
+    def result(self):
+        # parse and store on the consuming thread, the database connection is not shared
+        if self.future is not None:
+            r = self.future.result()
+            self.future = None
+            r.raise_for_status()
+            self.data = Raw_json(r.content)
+
+            if self.write:
+                self.api.db.insert_request_raw(self.url, r.content, r.request_time)
+
+        return self.data
+
+
+json_decoder = json.JSONDecoder()
+json_whitespace = re.compile(r'[ \t\n\r]*')
+
+def parse_with_items(text):
+    # decode a top level object in one pass, keeping the source text of each element of 'data'
+    skip = lambda i: json_whitespace.match(text, i).end()
+    value = dict()
+    items = None
+
+    idx = skip(0)
+    if text[idx] != '{':
+        return json.loads(text), None
+
+    idx = skip(idx + 1)
+    while text[idx] != '}':
+        key, idx = json_decoder.raw_decode(text, idx)
+        idx = skip(idx)
+        if text[idx] != ':':
+            raise ValueError(f'Expecting : at {idx}')
+        idx = skip(idx + 1)
+
+        if key == 'data' and text[idx] == '[':
+            element = []
+            items = []
+            idx = skip(idx + 1)
+
+            while text[idx] != ']':
+                start = idx
+                entry, idx = json_decoder.raw_decode(text, idx)
+                element.append(entry)
+                items.append(text[start:idx])
+                idx = skip(idx)
+                if text[idx] == ',':
+                    idx = skip(idx + 1)
+
+            idx += 1
+        else:
+            element, idx = json_decoder.raw_decode(text, idx)
+
+        value[key] = element
+        idx = skip(idx)
+        if text[idx] == ',':
+            idx = skip(idx + 1)
+
+    return value, items
+
+
+class Raw_json(collections.abc.MutableMapping):
+    # response body kept as received, parsed on first field access
+    def __init__(self, raw):
+        self.raw = raw
+        self.value = None
+        self.items_raw = None
+
+    def parse(self):
+        if self.value is None:
+            if json_codec.name != 'stdlib':
+                # a fast codec decodes and re-encodes stubs quicker than keeping their source spans
+                self.value = json_codec.loads(self.raw)
+                return self.value
+
+            text = self.raw.decode() if isinstance(self.raw, bytes) else self.raw
             try:
-                return time.mktime(time.strptime(stime, '%Y-%m-%dT%H:%M:%SZ'))
-            except:
-                return 0
+                self.value, self.items_raw = parse_with_items(text)
+            except (ValueError, IndexError):
+                self.value = json.loads(text)
+        return self.value
+
+    def data_items(self):
+        # (stub, source text) for each element of 'data', source text is None when unavailable
+        data = self.parse()['data']
+        items = self.items_raw if self.items_raw is not None and len(self.items_raw) == len(data) else [None] * len(data)
+        return zip(data, items)
+
+    def __getitem__(self, key):
+        return self.parse()[key]
+
+    def __setitem__(self, key, value):
+        self.parse()[key] = value
+
+    def __delitem__(self, key):
+        del self.parse()[key]
+
+    def __iter__(self):
+        return iter(self.parse())
+
+    def __len__(self):
+        return len(self.parse())
 
 
 class Depaginator:
-    def __init__(self, api, url, index=0, pageSize=50, write_local=True, use_local=True, time_diff=3600):
+    def __init__(self, api, url, index=0, pageSize=50, write_local=True, use_local=True, time_diff=3600, prefetch=None):
         self.api = api
         self.url = url
         self.index = index
@@ -128,10 +465,35 @@ class Depaginator:
         self.use_local = use_local
         self.time_diff = time_diff
 
+        # number of pages requested ahead once totalCount is known, 0 walks one page at a time
+        self.prefetch = api.config.prefetch if prefetch is None else prefetch
+        self.pending = collections.deque()
+        self.next_index = None
+        self.totalCount = None
+        self.failed = False
+
         self.current_url = self.format_url()
-    
-    def format_url(self):
-        append = f'index={self.index}&pageSize={self.pageSize}'
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        # cancel outstanding page fetches when the consumer stops early
+        for _, _, pending in self.pending:
+            pending.cancel()
+        self.pending.clear()
+
+    def format_url(self, index=None):
+        if index is None:
+            index = self.index
+
+        append = f'index={index}&pageSize={self.pageSize}'
         current_url = self.url
 
         if current_url[-1] not in '?&':
@@ -142,7 +504,21 @@ class Depaginator:
 
         return current_url + append
 
+    def fill(self):
+        if self.next_index is None:
+            self.next_index = self.index
+
+        while len(self.pending) < self.prefetch and self.next_index < self.totalCount:
+            url = self.format_url(self.next_index)
+            self.pending.append((self.next_index, url, self.api.submit_json(url, self.write_local, self.use_local, self.time_diff)))
+            self.next_index += self.pageSize
+
     def get_page(self):
+        if self.pending:
+            index, self.current_url, pending = self.pending.popleft()
+            self.fill()
+            return pending.result()
+
         self.current_url = self.format_url()
         return self.api.get_json(self.current_url, self.write_local, self.use_local, self.time_diff)
 
@@ -156,24 +532,33 @@ class Depaginator:
 
         if self.page != None:
             if self.page.get('pagination', None) == None:
+                self.close()
                 raise StopIteration()
             
             resultCount = self.page['pagination']['resultCount']
             totalCount = self.page['pagination']['totalCount']
 
             if self.index >= totalCount:
+                self.close()
                 raise StopIteration()
             
             if self.index + resultCount >= totalCount:
+                self.close()
                 raise StopIteration()
             
             self.index += self.pageSize
 
+            if self.prefetch > 0:
+                self.totalCount = totalCount
+                self.fill()
+
         try:
             self.page = self.get_page()
             self.page['url'] = self.current_url
         except Exception as e:
             print(e)
+            self.failed = True
+            self.close()
             raise StopIteration()
 
         if self.page.get('pagination', None) == None:
@@ -0,0 +1,60 @@
+#!/bin/python3
+
+import os
+import sys
+import time
+
+import config
+import json_codec
+import sqlite_helper as sqlh
+
+sample_size = 5000
+rounds = 3
+
+if not os.path.isfile(config.db_filepath):
+    print(f"Need path to database (from args: {config.db_filepath})")
+    sys.exit(1)
+
+db = sqlh.Sqlite_helper(config.db_filepath, dry_run=True)
+
+def sample_rows(table):
+    db.cur.execute(f'SELECT json FROM {table} LIMIT ?', (sample_size,))
+    return [row[0] for row in db.cur.fetchall()]
+
+def measure(func, samples):
+    # best of a few rounds, MiB/s of source text
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for x in samples:
+            func(x)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def report(label, samples, elapsed, size):
+    print(f"\t{label:24} {len(samples) / max(elapsed, 1e-9):12.0f}/s {size / max(elapsed, 1e-9) / 1048576:8.1f}MiB/s")
+
+for table, decode_typed in [('mods', 'decode_mod'), ('files', 'decode_file')]:
+    samples = sample_rows(table)
+    size = sum(len(x) for x in samples)
+
+    if not samples:
+        print(f"No rows in {table}")
+        continue
+
+    print(f"{table}: {len(samples)} rows ({size} bytes)")
+
+    for codec in json_codec.codecs[1:]:
+        if not json_codec.available(codec):
+            print(f"\t{codec} not installed")
+            continue
+
+        json_codec.set_codec(codec)
+        values = [json_codec.loads(x) for x in samples]
+
+        report(f'{codec} loads', samples, measure(json_codec.loads, samples), size)
+        report(f'{codec} dumps', samples, measure(json_codec.dumps, values), size)
+        report(f'{codec} {decode_typed}', samples, measure(getattr(json_codec, decode_typed), samples), size)
+
+print("Done")
@@ -0,0 +1,145 @@
+#!/bin/python3
+
+import os
+import sys
+import time
+import random
+
+import config
+import compression
+import sqlite_helper as sqlh
+
+batch_size = 1000
+sample_size = 2000
+
+if not os.path.isfile(config.db_filepath):
+    print(f"Need path to database (from args: {config.db_filepath})")
+    sys.exit(1)
+
+if not compression.available(config.cache_compression):
+    print(f"Compression codec {config.cache_compression} is not available")
+    sys.exit(1)
+
+db = sqlh.Sqlite_helper(config.db_filepath, config.dry_run, compression=config.cache_compression, compression_level=config.compression_level)
+
+def sizeof_fmt(num, suffix="B"):
+    for unit in ("", "Ki", "Mi", "Gi", "Ti", "Pi", "Ei", "Zi"):
+        if abs(num) < 1024.0:
+            return f"{num:3.1f}{unit}{suffix}"
+        num /= 1024.0
+    return f"{num:.1f}Yi{suffix}"
+
+def sample_requests(count):
+    # random rowids, gaps from deleted rows are skipped
+    db.cur.execute('SELECT MAX(rowid) FROM api_content')
+    max_rowid = db.cur.fetchone()[0] or 0
+    rowids = random.sample(range(1, max_rowid + 1), min(count, max_rowid))
+
+    samples = []
+    for rowid in rowids:
+        db.cur.execute('SELECT json, codec FROM api_content WHERE rowid=?', (rowid,))
+        row = db.cur.fetchone()
+        if row and row[0]:
+            samples.append(db.decode_request(*row).encode())
+
+    return samples
+
+def train():
+    codec = config.cache_compression
+    if codec == 'none':
+        print("Choose a codec with --cache-compression to train a dictionary")
+        sys.exit(1)
+
+    samples = sample_requests(sample_size)
+    print(f"Training {codec} dictionary from {len(samples)} responses")
+
+    dictionary = compression.train_dictionary(codec, samples)
+    dict_id = db.insert_dictionary(codec, dictionary)
+    db.write_codec = db.latest_codec(codec)
+    db.save()
+
+    print(f"Dictionary {dict_id} ({sizeof_fmt(len(dictionary))}) now used for {codec}")
+
+def benchmark():
+    samples = sample_requests(sample_size)
+    raw_bytes = sum(len(x) for x in samples)
+
+    print(f"Benchmark over {len(samples)} responses ({sizeof_fmt(raw_bytes)})")
+
+    candidates = [(name, None) for name in compression.codecs if compression.available(name)]
+
+    for name in compression.codecs:
+        dict_codec = db.latest_codec(name)
+        if compression.available(name) and dict_codec and dict_codec != name:
+            candidates.append((name, dict_codec))
+
+    for name, dict_codec in candidates:
+        compressor = db.get_compressor(dict_codec) if dict_codec else compression.Compressor(name, config.compression_level)
+
+        start = time.perf_counter()
+        encoded = [compressor.compress(x) for x in samples]
+        write_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for x in encoded:
+            compressor.decompress(x)
+        read_s = time.perf_counter() - start
+
+        stored_bytes = sum(len(x) for x in encoded)
+        label = dict_codec or name
+
+        print(f"\t{label:10} ratio {raw_bytes / max(stored_bytes, 1):6.2f}x "
+              f"stored {sizeof_fmt(stored_bytes):>9} "
+              f"write {raw_bytes / max(write_s, 1e-9) / 1048576:8.1f}MiB/s "
+              f"read {raw_bytes / max(read_s, 1e-9) / 1048576:8.1f}MiB/s")
+
+def recompress():
+    target = db.write_codec
+    print(f"Recompressing stored responses to {target or 'none'}")
+
+    db.cur.execute('SELECT COUNT(*) FROM api_content')
+    total = db.cur.fetchone()[0]
+
+    last_rowid = 0
+    counter = 0
+    before = 0
+    after = 0
+
+    while True:
+        db.cur.execute('SELECT rowid, json, codec FROM api_content WHERE rowid > ? ORDER BY rowid LIMIT ?', (last_rowid, batch_size))
+        rows = db.cur.fetchall()
+
+        if not rows:
+            break
+
+        updates = []
+
+        for rowid, data, codec in rows:
+            if codec == target or data is None:
+                continue
+
+            data_out, codec_out = db.encode_request(db.decode_request(data, codec))
+            before += len(data)
+            after += len(data_out)
+            updates.append((data_out, codec_out, rowid))
+
+        db.cur.executemany('UPDATE api_content SET json=?, codec=? WHERE rowid=?', updates)
+        db.save()
+
+        last_rowid = rows[-1][0]
+        counter += len(rows)
+        print(f"\r{counter}/{total} {sizeof_fmt(before)} -> {sizeof_fmt(after)}", end='', flush=True)
+
+    print()
+    print("Run VACUUM on the database to return freed pages to the filesystem")
+
+if config.benchmark:
+    benchmark()
+    sys.exit(0)
+
+if config.train_dictionary:
+    train()
+
+recompress()
+
+print("Done")
@@ -0,0 +1,130 @@
+import io
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+codecs = ['none', 'zlib', 'zstd']
+
+default_levels = {'zlib': 6, 'zstd': 3}
+
+zlib_dict_size = 32768
+
+def available(codec):
+    return codec in ['none', 'zlib'] or (codec == 'zstd' and zstandard is not None)
+
+def parse_codec(name):
+    # stored codec names are 'zlib', 'zstd' or with a dictionary id 'zstd:2'
+    if not name:
+        return 'none', None
+
+    codec, _, dict_id = name.partition(':')
+    return codec, int(dict_id) if dict_id else None
+
+def format_codec(codec, dict_id=None):
+    if codec == 'none':
+        return None
+
+    if dict_id is None:
+        return codec
+
+    return f'{codec}:{dict_id}'
+
+def train_dictionary(codec, samples, size=112640):
+    if codec == 'zstd':
+        return zstandard.train_dictionary(size, samples).as_bytes()
+
+    if codec == 'zlib':
+        # zlib only looks back 32KiB, keep the tail of the concatenated samples
+        return b''.join(samples)[-zlib_dict_size:]
+
+    raise ValueError(f'Codec {codec} has no dictionary support')
+
+class Zlib_reader(io.RawIOBase):
+    # decompressed output is bounded by the read size, the zstd stream_reader equivalent
+    def __init__(self, stream, dictionary=None, read_size=65536):
+        self.stream = stream
+        self.obj = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+        self.read_size = read_size
+
+    def readable(self):
+        return True
+
+    def close(self):
+        if not self.closed:
+            self.stream.close()
+        super().close()
+
+    def readinto(self, b):
+        while not self.obj.eof:
+            data = self.obj.unconsumed_tail or self.stream.read(self.read_size)
+            if not data:
+                break
+
+            out = self.obj.decompress(data, len(b))
+            if out:
+                b[:len(out)] = out
+                return len(out)
+
+        return 0
+
+class Compressor:
+    def __init__(self, codec='none', level=None, dictionary=None):
+        if not available(codec):
+            raise ValueError(f'Compression codec {codec} is not available')
+
+        self.codec = codec
+        self.level = default_levels.get(codec, 0) if level is None else level
+        self.dictionary = dictionary
+
+        if codec == 'zstd':
+            zdict = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            self.zstd_compressor = zstandard.ZstdCompressor(level=self.level, dict_data=zdict)
+            self.zstd_decompressor = zstandard.ZstdDecompressor(dict_data=zdict)
+
+    def compress(self, data:bytes):
+        if self.codec == 'zstd':
+            return self.zstd_compressor.compress(data)
+
+        if self.codec == 'zlib':
+            if self.dictionary:
+                obj = zlib.compressobj(self.level, zdict=self.dictionary)
+                return obj.compress(data) + obj.flush()
+            return zlib.compress(data, self.level)
+
+        return data
+
+    def decompress(self, data:bytes):
+        if self.codec == 'zstd':
+            return self.zstd_decompressor.decompress(data)
+
+        if self.codec == 'zlib':
+            if self.dictionary:
+                obj = zlib.decompressobj(zdict=self.dictionary)
+                return obj.decompress(data) + obj.flush()
+            return zlib.decompress(data)
+
+        return data
+
+    def compressobj(self):
+        # incremental compress()/flush() for data that does not fit in memory
+        if self.codec == 'zstd':
+            return self.zstd_compressor.compressobj()
+
+        if self.codec == 'zlib':
+            if self.dictionary:
+                return zlib.compressobj(self.level, zdict=self.dictionary)
+            return zlib.compressobj(self.level)
+
+        raise ValueError('Codec none has no compressobj')
+
+    def reader(self, stream):
+        if self.codec == 'zstd':
+            return self.zstd_decompressor.stream_reader(stream)
+
+        if self.codec == 'zlib':
+            return io.BufferedReader(Zlib_reader(stream, self.dictionary))
+
+        return stream
@@ -14,9 +14,33 @@ db_filepath = ':memory:'
 bucket_filename = 'bucket.db'
 bucket_filepath = ':memory:'
 bucket_module = 'file_bucket'
+download_buffer = 1048576
+download_workers = 4
+download_per_host = 2
+download_queue = 64
+pipeline = False
+pipeline_files = 4
+pipeline_texts = 4
+bucket_compression = 'none'
 category_filter = []
 game_filter = [432]
 wait_ms = 1000
+concurrency = 4
+max_rate = 0
+rate_step = 0.05
+prefetch = 8
+request_cache_size = 100000
+batch_size = 500
+json_codec = 'auto'
+synchronous = 'NORMAL'
+commit_rows = 5000
+commit_seconds = 30
+cache_compression = 'none'
+compression_level = None
+train_dictionary = False
+benchmark = False
+chunk_size = 16384
+repack_threshold = 0.25
 retry_limit = 4
 threshold = 1
 store_option = None
@@ -34,7 +58,7 @@ pid_file = 'curse.pid'
 pid_arg = None
 skip = []
 
-skippable = ['game_retrieve', 'game_iterate', 'category_retrieve', 'category_iterate', 'mod_iterate']
+skippable = ['game_retrieve', 'game_iterate', 'category_retrieve', 'category_iterate', 'mod_refresh', 'mod_iterate']
 
 parser = argparse.ArgumentParser(
     prog="Python Curseforge Scraper",
@@ -53,13 +77,37 @@ parser.add_argument('-dp', '--database-filepath', dest='dbfp', help='full path t
 parser.add_argument('-bf', '--bucket-filename', default=bucket_filename, dest='bf', help='filebucket connection filename')
 parser.add_argument('-bp', '--bucket-filepath', dest='bfp', help='full path to filebucket connection, ignores bucket filename option')
 parser.add_argument('-bm', '--bucket-module', default=bucket_module, dest='bm', help='filebucket python module override')
+parser.add_argument('--download-buffer', type=int, default=download_buffer, dest='dbuf', help='bytes held in memory per download, larger files are streamed through')
+parser.add_argument('--download-workers', type=int, default=download_workers, dest='dw', help='parallel file downloads, 0 downloads inline with the crawl')
+parser.add_argument('--download-per-host', type=int, default=download_per_host, dest='dph', help='parallel file downloads per host')
+parser.add_argument('--download-queue', type=int, default=download_queue, dest='dq', help='queued downloads before the crawl waits')
+parser.add_argument('--bucket-compression', default=bucket_compression, choices=['none', 'zlib', 'zstd'], dest='bc', help='compression for bucket files, levels and skipping depend on the content')
+parser.add_argument('--pipeline', action='store_true', dest='pipeline', help='stream new mods from search pages straight into file listing, changelog and download stages')
+parser.add_argument('--pipeline-files', type=int, default=pipeline_files, dest='pf', help='file listing requests queued at once with --pipeline, all stages share the --concurrency request threads')
+parser.add_argument('--pipeline-texts', type=int, default=pipeline_texts, dest='pt', help='description and changelog requests queued at once with --pipeline, all stages share the --concurrency request threads')
 parser.add_argument('-cf', '--category-filter', type=int, default=None, action='extend', nargs='*', dest='cf', help='category ids to collect')
 parser.add_argument('-gf', '--game-filter', type=int, default=None, action='extend', nargs='*', dest='gf', help='game ids to collect')
-parser.add_argument('-w', '--wait-ms', type=float, default=wait_ms, dest='w', help='wait time between requests in milliseconds')
+parser.add_argument('-w', '--wait-ms', type=float, default=wait_ms, dest='w', help='wait time between requests in milliseconds, enforced as a global rate')
+parser.add_argument('-j', '--concurrency', type=int, default=concurrency, dest='j', help='number of api requests in flight, wait time is shared between them')
+parser.add_argument('--max-rate', type=float, default=max_rate, dest='max_rate', help='requests per second the adaptive rate may climb to, 0 keeps the wait time as the ceiling')
+parser.add_argument('--rate-step', type=float, default=rate_step, dest='rate_step', help='requests per second added to the rate after each healthy response')
+parser.add_argument('--prefetch', type=int, default=prefetch, dest='prefetch', help='number of pages requested ahead while depaginating, 0 to disable')
+parser.add_argument('--request-cache-size', type=int, default=request_cache_size, dest='rcs', help='number of urls kept in the in-memory request freshness cache, 0 to disable')
+parser.add_argument('--batch-size', type=int, default=batch_size, dest='bs', help='number of ids per bulk mod and file request')
+parser.add_argument('--synchronous', default=synchronous, choices=['OFF', 'NORMAL', 'FULL'], dest='sync', help='sqlite synchronous mode for the database')
+parser.add_argument('--commit-rows', type=int, default=commit_rows, dest='commit_rows', help='commit after this many buffered rows')
+parser.add_argument('--commit-seconds', type=float, default=commit_seconds, dest='commit_seconds', help='commit after this many seconds')
+parser.add_argument('--json-codec', default=json_codec, choices=['auto', 'orjson', 'msgspec', 'stdlib'], dest='json_codec', help='json codec, auto picks the fastest installed')
 parser.add_argument('-r', '--retry-limit', type=int, default=retry_limit, dest='r', help='number of retries for a failed request')
 parser.add_argument('-t', '--stale-threshold', type=int, default=threshold, dest='threshold', help='Number of consecutive pages of stale data before leaving the current loop')
 parser.add_argument('-s', '--store-option', default='default', choices=['none', 'default', 'all', 'last'], dest='store', help='request storage usage')
 parser.add_argument('-c', '--cache-option', default='default', choices=['none', 'default', 'all', 'only'], dest='cache', help='request cache usage')
+parser.add_argument('--cache-compression', default=cache_compression, choices=['none', 'zlib', 'zstd'], dest='cc', help='compression for stored requests, uses the newest trained dictionary')
+parser.add_argument('--compression-level', type=int, default=compression_level, dest='cl', help='compression level, codec default when unset')
+parser.add_argument('--train-dictionary', action='store_true', dest='td', help='compress_cache.py: train a new dictionary from stored requests')
+parser.add_argument('--benchmark', action='store_true', dest='bench', help='compress_cache.py: report ratio and cost without modifying the database')
+parser.add_argument('--repack-threshold', type=float, default=repack_threshold, dest='rt', help='repack_bucket.py: rewrite packs with at least this fraction of garbage')
+parser.add_argument('--chunk-size', type=int, default=chunk_size, dest='chs', help='measure_dedup.py: average content-defined chunk size to evaluate')
 parser.add_argument('-f', '--full', action='store_true', dest='f', help='Enable when the final numbers show any discrepancies')
 parser.add_argument('--scrape-descriptions', action='store_true', dest='sd', help='Scrape descriptions for each mod')
 parser.add_argument('--scrape-changelogs', action='store_true', dest='sc', help='Scrape changelogs for each file')
@@ -88,7 +136,31 @@ game_filter = game_filter if args.gf is None else args.gf
 db_filename = args.dbf
 bucket_filename = args.bf
 bucket_module = args.bm
+download_buffer = args.dbuf
+download_workers = args.dw
+download_per_host = args.dph
+download_queue = args.dq
+pipeline = args.pipeline
+pipeline_files = args.pf
+pipeline_texts = args.pt
+bucket_compression = args.bc
 wait_ms = args.w
+concurrency = args.j
+max_rate = args.max_rate
+rate_step = args.rate_step
+prefetch = args.prefetch
+request_cache_size = args.rcs
+batch_size = args.bs
+json_codec = args.json_codec
+synchronous = args.sync
+commit_rows = args.commit_rows
+commit_seconds = args.commit_seconds
+cache_compression = args.cc
+compression_level = args.cl
+train_dictionary = args.td
+benchmark = args.bench
+chunk_size = args.chs
+repack_threshold = args.rt
 retry_limit = args.r
 threshold = args.threshold
 store_option = args.store
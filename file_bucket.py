@@ -1,30 +1,170 @@
 import sqlite3
 import hashlib
 import os
-import time
+import re
+import time as time_module
+import tempfile
+import shutil
+import queue
+import threading
+import bisect
+import array
 import requests
 from urllib.parse import urlparse
-import urllib.request
+
+import compression
+
+# formats that are already compressed are stored as they are
+image_magic = (b'\x89PNG', b'\xff\xd8\xff', b'GIF8')
+compressed_magic = (b'\x1f\x8b', b'\x28\xb5\x2f\xfd', b'BZh', b'\xfd7zXZ', b'7z\xbc\xaf', b'Rar!')
+
+# zstd/zlib level per content kind, kinds without a level are never compressed
+compression_levels = {'text': 9, 'binary': 6, 'archive': 3}
+
+def content_kind(sample):
+    if sample.startswith(b'PK\x03\x04'):
+        return 'archive'
+    if sample.startswith(image_magic) or (sample[:4] == b'RIFF' and sample[8:12] == b'WEBP'):
+        return 'image'
+    if sample.startswith(compressed_magic):
+        return 'compressed'
+    if b'\x00' not in sample:
+        return 'text'
+    return 'binary'
+
+def read_chunks(first, stream, size):
+    if first:
+        yield first
+
+    while True:
+        data = stream.read(size)
+        if not data:
+            break
+        yield data
+
+def response_validator(r):
+    # weak etags are not allowed in If-Range
+    etag = r.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return r.headers.get('Last-Modified')
+
+def expected_md5(hashes):
+    # curseforge lists md5 as algo 2
+    for entry in hashes or []:
+        if entry.get('algo') == 2 and entry.get('value'):
+            return entry['value'].lower()
+    return None
+
+def content_range_start(r):
+    match = re.match(r'bytes (\d+)-', r.headers.get('Content-Range', ''))
+    return int(match.group(1)) if match else None
+
+def url_key(url):
+    return int.from_bytes(hashlib.blake2b(url.encode(), digest_size=8).digest(), 'little', signed=True)
+
+class Url_index:
+    # 64 bit url hashes in a sorted array plus a dict for urls added since, about 16 bytes per url
+    def __init__(self, rows):
+        pairs = sorted((url_key(url), time or 0) for url, time in rows)
+        self.keys = array.array('q', (key for key, _ in pairs))
+        self.times = array.array('d', (time for _, time in pairs))
+        self.recent = dict()
+
+    def __len__(self):
+        return len(self.keys) + len(self.recent)
+
+    def get(self, url):
+        key = url_key(url)
+
+        if key in self.recent:
+            return True, self.recent[key]
+
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return True, self.times[i]
+
+        return False, None
+
+    def put(self, url, time):
+        self.recent[url_key(url)] = time or 0
 
 class Filebucket:
-    def __init__(self, path, dry_run=False):
+    def __init__(self, path, dry_run=False, buffer_size=1048576, workers=0, per_host=2, queue_size=64, compression='none'):
         self.dry_run = dry_run
+        self.buffer_size = buffer_size
+        self.compression = compression
+        self.compressors = dict()
+        self.sample_size = 262144
+        self.min_ratio = 0.9
+        self.storage_stats = dict()
+        self.saved_files = 0
+        self.saved_bytes = 0
         self.client = requests.Session()
+        self.timeout = 60
+
+        # large downloads go through a partial file kept across runs and are resumed with range requests
+        self.partialdir = None if path == ':memory:' else os.path.splitext(os.path.abspath(path))[0] + '-partial'
+        self.resume_size = 16777216
+        self.resume_step = 67108864
+        self.resume_attempts = 3
+
+        # the connection is shared with the download workers, every use holds the lock
+        self.lock = threading.RLock()
+        self.closed = False
 
         self.load(path)
         self.init()
+        self.start_workers(workers, per_host, queue_size)
 
     def __del__(self):
         self.close()
 
     def init(self):
         self.cur.execute("CREATE TABLE IF NOT EXISTS files(hash, length, filename, time, data)")
+        self.init_api()
+        self.cur.execute("CREATE INDEX IF NOT EXISTS files_hash ON files(hash)")
+        self.cur.execute("CREATE TABLE IF NOT EXISTS partials(url TEXT PRIMARY KEY, path, offset INTEGER, length INTEGER, validator, time)")
+
+        # per row codec, stored size and content kind, NULL codec is raw data
+        self.cur.execute("PRAGMA table_info(files)")
+        columns = [row[1] for row in self.cur.fetchall()]
+        for column in ['codec', 'stored', 'kind']:
+            if column not in columns:
+                self.cur.execute(f"ALTER TABLE files ADD COLUMN {column}")
+
+    def init_api(self):
         self.cur.execute("CREATE TABLE IF NOT EXISTS api(url, id, filename, time, hash)")
 
+        # api had no key, INSERT OR REPLACE appended duplicates, the newest row per url is kept
+        self.cur.execute("SELECT count(*) FROM sqlite_master WHERE type='index' AND name='api_url'")
+        if not self.cur.fetchone()[0]:
+            self.cur.execute("DELETE FROM api WHERE rowid NOT IN (SELECT MAX(rowid) FROM api GROUP BY url)")
+            if self.cur.rowcount > 0:
+                print(f"Removed {self.cur.rowcount} duplicate bucket urls")
+            self.cur.execute("CREATE UNIQUE INDEX api_url ON api(url)")
+            if not self.dry_run:
+                self.con.commit()
+
+        # membership checks for known urls never reach sqlite
+        self.cur.execute("SELECT url, time FROM api")
+        self.urls = Url_index(self.cur)
+        print(f"Loaded {len(self.urls)} bucket urls")
+
     def close(self):
+        if self.closed:
+            return
+
+        self.stop_workers()
         self.save()
+        if self.saved_files:
+            print(f"Skipped {self.saved_files} downloads already in bucket ({self.saved_bytes} bytes)")
+        self.report_storage()
         print("Close bucket")
-        self.con.close()
+
+        with self.lock:
+            self.closed = True
+            self.con.close()
 
     def load(self, path=None):
         if path is None:
@@ -33,71 +173,524 @@ class Filebucket:
             self.path = path
 
         print("Connect to bucket:", path)
-        self.con = sqlite3.connect(path)
+        self.con = sqlite3.connect(path, check_same_thread=False)
         self.cur = self.con.cursor()
 
     def save(self):
         if not self.dry_run:
             print("Commit to bucket:", self.path)
             try:
-                self.con.commit()
+                with self.lock:
+                    self.con.commit()
             except Exception as e:
                 print("Failed to commit to bucket:", e)
 
+    def start_workers(self, workers, per_host, queue_size):
+        # downloads run beside the metadata crawl, try_insert_url blocks once the queue is full
+        self.workers = []
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.queued = set()
+        self.per_host = per_host
+        self.host_limits = {}
+        self.stopping = False
+        self.downloaded_files = 0
+        self.downloaded_bytes = 0
+        self.download_start = time_module.time()
+        self.last_report = self.download_start
+
+        for i in range(workers):
+            worker = threading.Thread(target=self.download_worker, name=f'bucket-download-{i}', daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def stop_workers(self):
+        if not self.workers:
+            return
+
+        if self.stopping:
+            self.drop_queued()
+        else:
+            print(f"Waiting for {self.queue.qsize()} queued downloads")
+            self.queue.join()
+
+        for _ in self.workers:
+            self.queue.put(None)
+
+        for worker in self.workers:
+            worker.join()
+
+        self.workers = []
+        self.report_downloads()
+
+    def interrupt(self):
+        # safe from a signal handler, queued downloads are dropped by stop_workers and transfers in progress are abandoned at the next chunk
+        self.stopping = True
+
+    def drop_queued(self):
+        while True:
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+            except queue.Empty:
+                break
+
+    def host_limit(self, url):
+        host = urlparse(url).netloc
+
+        with self.lock:
+            if host not in self.host_limits:
+                self.host_limits[host] = threading.Semaphore(self.per_host)
+            return self.host_limits[host]
+
+    def download_worker(self):
+        session = requests.Session()
+
+        while True:
+            task = self.queue.get()
+
+            if task is None:
+                self.queue.task_done()
+                break
+
+            url = task[0]
+
+            try:
+                if not self.stopping:
+                    with self.host_limit(url):
+                        self.insert_url(*task, session=session)
+            except Exception as e:
+                print("Failed to insert url:", url)
+                print(e)
+            finally:
+                with self.lock:
+                    self.queued.discard(url)
+                self.queue.task_done()
+
+        session.close()
+
+    def report_downloads(self):
+        elapsed = max(time_module.time() - self.download_start, 1e-9)
+        print(f"Downloads: {self.downloaded_files} files {self.downloaded_bytes / 1048576:.1f}MiB "
+              f"{self.downloaded_bytes / elapsed / 1048576:.2f}MiB/s queue {self.queue.qsize()}/{self.queue.maxsize}")
+        self.last_report = time_module.time()
+
     def get_hash(self, stream):
         return hashlib.file_digest(stream, "md5").hexdigest()
 
     def insert_stream(self, url, stream, length = None, time = None, id = None, filename = None):
-        blob = stream.read()
-        hash = hashlib.md5(blob).hexdigest()
-        #print(stream)
-        #stream.seek(0, os.SEEK_END)
-        #length = stream.tell()
-        #length = stream
+        # copied in buffer_size chunks, memory use does not depend on the file size
         if not time:
-            time = time.time()
+            time = time_module.time()
 
-        self.cur.execute("INSERT OR REPLACE INTO files(hash, length, filename, time, data) VALUES(?,?,?,?,?)", (hash, length, filename, time, sqlite3.Binary(blob)))
-        self.cur.execute("INSERT OR REPLACE INTO api(url, id, filename, time, hash) VALUES(?,?,?,?,?)", (url, id, filename, time, hash))
+        if length is None:
+            spool, length = self.spool(stream)
+            with spool:
+                return self.insert_stream(url, spool, length, time, id, filename)
+
+        length = int(length)
+
+        with self.lock:
+            hash = self.write_blob(stream, length, filename, time)
+            self.insert_mapping(url, hash, time, id, filename)
+
+    def spool(self, stream):
+        # kept in memory up to buffer_size, then on disk
+        spool = tempfile.SpooledTemporaryFile(max_size=self.buffer_size)
+
+        while True:
+            data = stream.read(self.buffer_size)
+            if not data:
+                break
+            if self.stopping:
+                spool.close()
+                raise InterruptedError('Download interrupted')
+            spool.write(data)
+
+        length = spool.tell()
+        spool.seek(0)
+        return spool, length
+
+    def get_compressor(self, codec, level=None):
+        if (codec, level) not in self.compressors:
+            self.compressors[(codec, level)] = compression.Compressor(codec, level)
+        return self.compressors[(codec, level)]
+
+    def choose_compressor(self, kind, sample):
+        level = compression_levels.get(kind)
+
+        if self.compression == 'none' or level is None or not sample:
+            return None
+
+        # a fast pass over the start decides whether the whole object is worth compressing
+        sample = sample[:self.sample_size]
+        if len(self.get_compressor(self.compression, 1).compress(sample)) > len(sample) * self.min_ratio:
+            return None
+
+        return self.get_compressor(self.compression, level)
+
+    def write_blob(self, stream, length, filename, time):
+        sample = stream.read(self.buffer_size)
+        kind = content_kind(sample)
+        compressor = self.choose_compressor(kind, sample)
+        chunks = read_chunks(sample, stream, self.buffer_size)
+
+        if compressor is None:
+            hash, stored = self.write_raw(chunks, length, filename, time, kind)
+        else:
+            hash, stored = self.write_compressed(chunks, length, filename, time, kind, compressor)
+
+        if stored is not None:
+            stats = self.storage_stats.setdefault(kind, [0, 0, 0])
+            stats[0] += 1
+            stats[1] += length
+            stats[2] += stored
+
+        return hash
+
+    def write_raw(self, chunks, length, filename, time, kind):
+        # pre-sized blob filled with incremental blob io, the hash is set once the content is known
+        self.cur.execute("INSERT INTO files(hash, length, filename, time, data, codec, stored, kind) VALUES(NULL,?,?,?,zeroblob(?),NULL,?,?)", (length, filename, time, length, length, kind))
+        rowid = self.cur.lastrowid
+        md5 = hashlib.md5()
+        written = 0
+
+        try:
+            with self.con.blobopen('files', 'data', rowid) as blob:
+                for data in chunks:
+                    if written + len(data) > length:
+                        raise ValueError(f'Stream is longer than {length} bytes')
+                    blob.write(data)
+                    md5.update(data)
+                    written += len(data)
+
+            if written != length:
+                raise ValueError(f'Stream ended after {written} of {length} bytes')
+        except:
+            self.cur.execute("DELETE FROM files WHERE rowid=?", (rowid,))
+            raise
+
+        hash = md5.hexdigest()
+
+        if self.hash_exists(hash):
+            self.cur.execute("DELETE FROM files WHERE rowid=?", (rowid,))
+            return hash, None
+
+        self.cur.execute("UPDATE files SET hash=? WHERE rowid=?", (hash, rowid))
+        return hash, length
+
+    def write_compressed(self, chunks, length, filename, time, kind, compressor):
+        # compressed size is only known at the end, spool it before sizing the blob
+        md5 = hashlib.md5()
+        obj = compressor.compressobj()
+        written = 0
+
+        with tempfile.SpooledTemporaryFile(max_size=self.buffer_size) as spool:
+            for data in chunks:
+                written += len(data)
+                if written > length:
+                    raise ValueError(f'Stream is longer than {length} bytes')
+                md5.update(data)
+                spool.write(obj.compress(data))
+
+            spool.write(obj.flush())
+
+            if written != length:
+                raise ValueError(f'Stream ended after {written} of {length} bytes')
+
+            hash = md5.hexdigest()
+
+            if self.hash_exists(hash):
+                return hash, None
+
+            stored = spool.tell()
+            spool.seek(0)
+
+            self.cur.execute("INSERT INTO files(hash, length, filename, time, data, codec, stored, kind) VALUES(?,?,?,?,zeroblob(?),?,?,?)", (hash, length, filename, time, stored, compressor.codec, stored, kind))
+            rowid = self.cur.lastrowid
+
+            try:
+                with self.con.blobopen('files', 'data', rowid) as blob:
+                    shutil.copyfileobj(spool, blob, self.buffer_size)
+            except:
+                self.cur.execute("DELETE FROM files WHERE rowid=?", (rowid,))
+                raise
+
+        return hash, stored
+
+    def report_storage(self):
+        for kind, (count, length, stored) in sorted(self.storage_stats.items()):
+            print(f"Stored {kind}: {count} files {length} -> {stored} bytes ({length / max(stored, 1):.2f}x)")
 
     def insert_file(self, url, path, length = None, time = None, id = None, filename = None):
         with open(path, 'rb') as fstream:
             self.insert_stream(url, fstream, length, time, id, filename)
     
-    def insert_url(self, url, length = None, time = None, id = None, filename = None):
-        print("Downloading:", url, end='', flush=True)
-        with urllib.request.urlopen(url) as fstream:
-            length = fstream.getheader('Content-Length')
-            print(" Got response:", fstream.getcode())
-            self.insert_stream(url, fstream, length, time, id, filename)
+    def insert_url(self, url, length = None, time = None, id = None, filename = None, md5 = None, session = None):
+        print("Downloading:", url, flush=True)
+        session_used = session or self.client
+        expected = length
+
+        partial = self.get_partial(url)
+        if partial:
+            received = self.resume_partial(session_used, url, partial, expected, md5, time, id, filename)
+        else:
+            with session_used.get(url, stream=True, timeout=self.timeout) as r:
+                r.raise_for_status()
+                r.raw.decode_content = True
+
+                # content-length counts encoded bytes
+                length = None if 'Content-Encoding' in r.headers else r.headers.get('Content-Length', length)
+
+                if self.partialdir and length and int(length) >= self.resume_size:
+                    partial = self.start_partial(url, length, response_validator(r))
+                    try:
+                        self.fill_partial(url, r, partial)
+                    except requests.RequestException as e:
+                        if self.stopping:
+                            raise
+                        print("Download failed, resuming:", url, e)
+                    except ValueError:
+                        self.drop_partial(url, partial)
+                        raise
+                elif session is None:
+                    self.insert_stream(url, r.raw, length, time, id, filename)
+                    received = int(length or 0)
+                else:
+                    # network reads happen without the lock, only the copy into the database holds it
+                    spool, received = self.spool(r.raw)
+                    with spool:
+                        self.insert_stream(url, spool, received, time, id, filename)
+
+            if partial:
+                received = self.resume_partial(session_used, url, partial, expected, md5, time, id, filename)
+
+        with self.lock:
+            self.downloaded_files += 1
+            self.downloaded_bytes += received
+
+            if self.workers and time_module.time() - self.last_report > 10:
+                self.report_downloads()
+
+    def get_partial(self, url):
+        if not self.partialdir:
+            return None
+
+        with self.lock:
+            self.cur.execute("SELECT path, offset, length, validator FROM partials WHERE url=?", (url,))
+            row = self.cur.fetchone()
+
+        if row and not os.path.exists(row[0]):
+            self.drop_partial(url, None)
+            return None
+
+        return list(row) if row else None
+
+    def start_partial(self, url, length, validator):
+        os.makedirs(self.partialdir, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self.partialdir, suffix='.part')
+        os.close(fd)
+
+        partial = [path, 0, int(length), validator]
+        self.record_partial(url, partial)
+        return partial
+
+    def record_partial(self, url, partial):
+        with self.lock:
+            # a bucket closed by a signal keeps the last recorded offset
+            if self.closed:
+                return
+            self.cur.execute("INSERT OR REPLACE INTO partials(url, path, offset, length, validator, time) VALUES(?,?,?,?,?,?)", (url, *partial, time_module.time()))
+
+    def drop_partial(self, url, partial):
+        with self.lock:
+            self.cur.execute("DELETE FROM partials WHERE url=?", (url,))
+
+        if partial and os.path.exists(partial[0]):
+            os.unlink(partial[0])
+
+    def fill_partial(self, url, r, partial):
+        # the offset is recorded after fsync, bytes past it are never trusted on resume
+        path, offset, length = partial[0], partial[1], partial[2]
+        recorded = offset
+
+        with open(path, 'r+b') as f:
+            f.truncate(offset)
+            f.seek(offset)
+
+            try:
+                for data in r.iter_content(self.buffer_size):
+                    if self.stopping:
+                        raise InterruptedError('Download interrupted')
+                    if offset + len(data) > length:
+                        raise ValueError(f'Download is longer than {length} bytes')
+
+                    f.write(data)
+                    offset += len(data)
+
+                    if offset - recorded >= self.resume_step:
+                        f.flush()
+                        os.fsync(f.fileno())
+                        partial[1] = recorded = offset
+                        self.record_partial(url, partial)
+            finally:
+                f.flush()
+                os.fsync(f.fileno())
+                partial[1] = offset
+                self.record_partial(url, partial)
+
+    def request_partial(self, session, url, partial):
+        headers = {'Range': f'bytes={partial[1]}-'}
+        if partial[3]:
+            headers['If-Range'] = partial[3]
+
+        with session.get(url, headers=headers, stream=True, timeout=self.timeout) as r:
+            if r.status_code == 416:
+                partial[1] = 0
+                return
+
+            r.raise_for_status()
+
+            if r.status_code == 206 and content_range_start(r) == partial[1]:
+                print(f"Resuming {url} at {partial[1]}/{partial[2]}")
+                self.fill_partial(url, r, partial)
+                return
+
+            # a full response means the content changed or ranges are unsupported, start over
+            if r.status_code != 206:
+                self.restart_partial(url, r, partial)
+                return
+
+            # a range starting anywhere else cannot be appended, the file is fetched again without one
+            print("Range does not match offset, restarting:", url, r.headers.get('Content-Range'))
+
+        with session.get(url, stream=True, timeout=self.timeout) as r:
+            r.raise_for_status()
+
+            if r.status_code != 200:
+                raise requests.HTTPError(f'Unexpected status {r.status_code} for full download', response=r)
+
+            self.restart_partial(url, r, partial)
+
+    def restart_partial(self, url, r, partial):
+        # only a full response may be written from offset 0
+        partial[1] = 0
+        partial[3] = response_validator(r)
+        length = r.headers.get('Content-Length')
+        if length and 'Content-Encoding' not in r.headers:
+            partial[2] = int(length)
+
+        self.fill_partial(url, r, partial)
+
+    def resume_partial(self, session, url, partial, expected, md5, time, id, filename):
+        # hash state cannot be saved, the finished partial is hashed while it is copied into the bucket
+        attempt = 0
+
+        try:
+            while partial[1] < partial[2]:
+                if attempt >= self.resume_attempts:
+                    raise IOError(f'Download incomplete after {attempt} attempts, kept {partial[1]}/{partial[2]} bytes')
+                attempt += 1
+
+                try:
+                    self.request_partial(session, url, partial)
+                except requests.RequestException as e:
+                    if self.stopping:
+                        raise
+                    print("Download failed, resuming:", url, e)
+
+            if expected and int(expected) != partial[2]:
+                raise ValueError(f'Downloaded {partial[2]} bytes, file length is {expected}')
+
+            if md5:
+                with open(partial[0], 'rb') as f:
+                    hash = self.get_hash(f)
+                if hash != md5:
+                    raise ValueError(f'Downloaded md5 {hash}, file hash is {md5}')
+        except ValueError:
+            self.drop_partial(url, partial)
+            raise
+
+        with open(partial[0], 'rb') as f:
+            self.insert_stream(url, f, partial[2], time, id, filename)
+
+        self.drop_partial(url, partial)
+        return partial[2]
 
     def get_stream(self, hash):
-        self.cur.execute("SELECT data FROM files WHERE hash=?", (hash,))
-        return self.cur.fetchone()[0]
+        # readable blob, nothing is loaded until it is read
+        with self.lock:
+            self.cur.execute("SELECT rowid, codec FROM files WHERE hash=?", (hash,))
+            rowid, codec = self.cur.fetchone()
+            blob = self.con.blobopen('files', 'data', rowid, readonly=True)
+
+            if codec:
+                return self.get_compressor(codec).reader(blob)
+
+        return blob
     
     def hash_exists(self, hash):
         self.cur.execute("SELECT count(*) FROM files WHERE hash=?", (hash,))
         return self.cur.fetchone()[0] > 0
 
     def url_exists(self, url):
-        self.cur.execute("SELECT count(*) FROM api WHERE url=?", (url,))
-        return self.cur.fetchone()[0] > 0
+        return self.urls.get(url)[0]
 
     def should_update_file(self, url, time):
-        if not self.url_exists(url):
-            return True
+        found, last_time = self.urls.get(url)
 
-        self.cur.execute("SELECT time FROM api WHERE url=?", (url,))
-        last_time = self.cur.fetchone()[0]
+        if not found:
+            return True
 
         return not last_time or not time or last_time < time
 
-    def try_insert_url(self, url, time = None, length = None, id = None, filename = None):
+    def insert_mapping(self, url, hash, time = None, id = None, filename = None):
+        if not time:
+            time = time_module.time()
+
+        self.cur.execute("INSERT OR REPLACE INTO api(url, id, filename, time, hash) VALUES(?,?,?,?,?)", (url, id, filename, time, hash))
+        self.urls.put(url, time)
+
+    def find_known_hash(self, hashes, length = None):
+        # bucket content is keyed by md5, curseforge lists it as algo 2
+        for entry in hashes or []:
+            if entry.get('algo') != 2 or not entry.get('value'):
+                continue
+
+            hash = entry['value'].lower()
+            # older buckets stored the Content-Length header as text
+            self.cur.execute("SELECT CAST(length AS INTEGER) FROM files WHERE hash=? LIMIT 1", (hash,))
+            row = self.cur.fetchone()
+
+            if row and (not length or row[0] == int(length)):
+                return hash, row[0]
+
+        return None, None
+
+    def try_insert_url(self, url, time = None, length = None, id = None, filename = None, hashes = None):
         try:
-            if not self.should_update_file(url, time):
+            with self.lock:
+                if url in self.queued or not self.should_update_file(url, time):
+                    return
+
+                hash, known_length = self.find_known_hash(hashes, length)
+                if hash:
+                    print("Already in bucket:", url, hash)
+                    self.insert_mapping(url, hash, time, id, filename)
+                    self.saved_files += 1
+                    self.saved_bytes += known_length or 0
+                    return
+
+                if self.workers:
+                    self.queued.add(url)
+
+            md5 = expected_md5(hashes)
+
+            if self.workers:
+                if not self.stopping:
+                    self.queue.put((url, length, time, id, filename, md5))
                 return
 
-            self.insert_url(url, length, time, id, filename)
+            self.insert_url(url, length, time, id, filename, md5)
         except Exception as e:
             print("Failed to insert url:", url)
-            print(e)
\ No newline at end of file
+            print(e)
@@ -0,0 +1,194 @@
+import io
+import random
+import hashlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import file_bucket as Filebucket_module
+
+# FastCDC gear table, fixed seed so chunk boundaries stay stable between runs
+gear_rng = random.Random(0x6765617220)
+gear = [gear_rng.getrandbits(64) for _ in range(256)]
+bits64 = (1 << 64) - 1
+
+if numpy is not None:
+    gear_array = numpy.array(gear, dtype=numpy.uint64)
+    gear_shifts = numpy.arange(64, dtype=numpy.uint64)
+
+def high_mask(bits):
+    # gear hash high bits depend on the last 64 bytes
+    return ((1 << bits) - 1) << (64 - bits)
+
+class Chunker:
+    def __init__(self, avg_size=16384):
+        bits = max(avg_size.bit_length() - 1, 8)
+        self.avg_size = 1 << bits
+        self.min_size = self.avg_size // 4
+        self.max_size = self.avg_size * 8
+        # normalized chunking, harder to cut before the average size and easier after
+        self.mask_small = high_mask(bits + 2)
+        self.mask_large = high_mask(bits - 2)
+
+    def cut(self, data, end):
+        if end <= self.min_size:
+            return end
+
+        end = min(end, self.max_size)
+        normal = min(end, self.avg_size)
+
+        if numpy is not None:
+            return self.cut_vectorized(data, normal, end)
+
+        mask_small = self.mask_small
+        mask_large = self.mask_large
+        fp = 0
+        i = self.min_size
+
+        while i < normal:
+            fp = ((fp << 1) + gear[data[i]]) & bits64
+            i += 1
+            if not fp & mask_small:
+                return i
+
+        while i < end:
+            fp = ((fp << 1) + gear[data[i]]) & bits64
+            i += 1
+            if not fp & mask_large:
+                return i
+
+        return end
+
+    def cut_vectorized(self, data, normal, end):
+        # the same boundaries as the loop in cut, a gear hash is the sum of the last 64 gear values shifted by their age
+        # windows of 1, 2, 4 .. 64 values are summed by doubling, hashing starts at min_size so a window never reaches back past it
+        view = numpy.frombuffer(data, dtype=numpy.uint8, count=end)
+
+        for start, stop, mask in ((self.min_size, normal, self.mask_small), (normal, end, self.mask_large)):
+            mask = numpy.uint64(mask)
+            i = start
+
+            while i < stop:
+                block_end = min(i + self.avg_size, stop)
+                context = max(i - 63, self.min_size)
+                fp = gear_array[view[context:block_end]]
+                width = 1
+
+                while width < 64 and width < len(fp):
+                    fp[width:] += fp[:-width] << gear_shifts[width]
+                    width *= 2
+
+                hits = numpy.flatnonzero((fp[i - context:] & mask) == 0)
+                if len(hits):
+                    return i + int(hits[0]) + 1
+
+                i = block_end
+
+        return end
+
+    def chunks(self, stream):
+        # chunks are cut from a view at an offset, the buffer is only copied when it is refilled
+        buffer = b''
+        position = 0
+        eof = False
+
+        while True:
+            while not eof and len(buffer) - position < self.max_size:
+                data = stream.read(self.max_size)
+                if not data:
+                    eof = True
+                else:
+                    buffer = buffer[position:] + data
+                    position = 0
+
+            remaining = len(buffer) - position
+
+            if not remaining:
+                break
+
+            if eof and remaining <= self.min_size:
+                yield buffer[position:]
+                break
+
+            cut = self.cut(memoryview(buffer)[position:], remaining)
+            yield buffer[position:position + cut]
+            position += cut
+
+class Chunk_stream(io.RawIOBase):
+    def __init__(self, bucket, chunk_hashes):
+        self.bucket = bucket
+        self.chunk_hashes = iter(chunk_hashes)
+        self.buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buffer:
+            chunk_hash = next(self.chunk_hashes, None)
+            if chunk_hash is None:
+                return 0
+            self.buffer = self.bucket.get_chunk(chunk_hash)
+
+        n = min(len(b), len(self.buffer))
+        b[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return n
+
+class Filebucket(Filebucket_module.Filebucket):
+    def __init__(self, path, dry_run=False, buffer_size=1048576, workers=0, per_host=2, queue_size=64, compression='none', chunk_size=16384):
+        self.chunker = Chunker(chunk_size)
+        super().__init__(path, dry_run, buffer_size, workers, per_host, queue_size, compression)
+
+    def init(self):
+        super().init()
+        self.cur.execute("CREATE TABLE IF NOT EXISTS chunks(hash TEXT PRIMARY KEY, length INTEGER, data BLOB)")
+        self.cur.execute("CREATE TABLE IF NOT EXISTS file_chunks(hash TEXT, seq INTEGER, chunk TEXT, PRIMARY KEY(hash, seq)) WITHOUT ROWID")
+
+    def write_blob(self, stream, length, filename, time):
+        # files rows keep data NULL, content lives in shared chunks
+        md5 = hashlib.md5()
+        written = 0
+        chunk_hashes = []
+
+        for chunk in self.chunker.chunks(stream):
+            md5.update(chunk)
+            written += len(chunk)
+            if written > length:
+                raise ValueError(f'Stream is longer than {length} bytes')
+
+            chunk_hash = hashlib.sha1(chunk).hexdigest()
+            self.cur.execute("INSERT OR IGNORE INTO chunks(hash, length, data) VALUES(?,?,?)", (chunk_hash, len(chunk), chunk))
+            chunk_hashes.append(chunk_hash)
+
+        if written != length:
+            raise ValueError(f'Stream ended after {written} of {length} bytes')
+
+        hash = md5.hexdigest()
+
+        if not self.hash_exists(hash):
+            self.cur.execute("INSERT INTO files(hash, length, filename, time, data) VALUES(?,?,?,?,NULL)", (hash, length, filename, time))
+            self.cur.executemany("INSERT INTO file_chunks(hash, seq, chunk) VALUES(?,?,?)", [(hash, seq, chunk_hash) for seq, chunk_hash in enumerate(chunk_hashes)])
+
+        return hash
+
+    def get_chunk(self, chunk_hash):
+        with self.lock:
+            self.cur.execute("SELECT data FROM chunks WHERE hash=?", (chunk_hash,))
+            return self.cur.fetchone()[0]
+
+    def get_stream(self, hash):
+        with self.lock:
+            self.cur.execute("SELECT chunk FROM file_chunks WHERE hash=? ORDER BY seq", (hash,))
+            chunk_hashes = [row[0] for row in self.cur.fetchall()]
+
+            # whole-file rows from before the bucket was chunked, chunked empty files have no chunks and NULL data
+            if not chunk_hashes:
+                self.cur.execute("SELECT data IS NULL FROM files WHERE hash=?", (hash,))
+                row = self.cur.fetchone()
+                if not row or not row[0]:
+                    return super().get_stream(hash)
+
+        return io.BufferedReader(Chunk_stream(self, chunk_hashes))
@@ -1,80 +1,146 @@
-import sqlite3
-import hashlib
 import os
-import time
-import requests
-from urllib.parse import urlparse
-import urllib.request
-import importlib
+import shutil
+import hashlib
+import tempfile
+import time as time_module
 
 import file_bucket as Filebucket_module
-from file_bucket import Filebucket
 
 class Filebucket(Filebucket_module.Filebucket):
-    def exists_filesystem_path(self, path):
-        return os.path.exists(path)
-
-    def insert_stream(self, url, stream, length=None, time=None, id=None, filename=None):
-        bufsize = 65536
-        md5 = hashlib.md5()
-
-        stageid = 'dummy'
-        length = 0
-
-        if id:
-            stageid = id
-
-        stagedir = self.path + '/stage/'
-
-        if not os.path.exists(stagedir):
-            os.makedirs(stagedir, exist_ok=True)
-
-        path = self.path + '/stage/' + stageid
+    # content is kept as plain files next to the bucket database, bucket.db -> bucket/objects/aa/bb/
+    def __init__(self, path, dry_run=False, buffer_size=1048576, workers=0, per_host=2, queue_size=64, compression='none', fsync_batch=256):
+        self.fsync_batch = fsync_batch
+        self.unsynced = []
+        super().__init__(path, dry_run, buffer_size, workers, per_host, queue_size, compression)
 
-        with open(path, 'wb') as ostream:
-            while True:
-                data = stream.read(bufsize)
-                if not data:
-                    break
-                length += len(data)
-                md5.update(data)
-                ostream.write(data)
+    def init(self):
+        super().init()
 
-        hash = md5.hexdigest()
-        depth = 3
-        width = 2
-        splithash = [hash[x*width:x*width+width] for x in range(depth)]
-
-        if not id:
-            filename = f'{hash}'
-        elif not filename and id:
-            filename = f'{hash} {id}'
+        if self.path == ':memory:':
+            self.root = tempfile.mkdtemp(suffix='-bucket')
         else:
-            filename = f'{hash} {id}' + str(filename).split('.')[-1]
+            self.root = os.path.splitext(os.path.abspath(self.path))[0]
+        self.stagedir = os.path.join(self.root, 'stage')
+        self.objectdir = os.path.join(self.root, 'objects')
+        os.makedirs(self.stagedir, exist_ok=True)
+        os.makedirs(self.objectdir, exist_ok=True)
+
+    def close(self):
+        if self.closed:
+            return
+
+        super().close()
+
+        # an in-memory bucket's objects go with it
+        if self.path == ':memory:':
+            shutil.rmtree(self.root, ignore_errors=True)
+
+    def save(self):
+        # file contents reach the disk before the rows that point at them are committed
+        with self.lock:
+            self.sync()
+        super().save()
+
+    def sync(self):
+        if not self.unsynced:
+            return
+
+        dirs = set()
+
+        for path in self.unsynced:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            dirs.add(os.path.dirname(path))
+
+        for path in dirs:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+        self.unsynced = []
+
+    def object_name(self, hash, id=None, filename=None):
+        if not id:
+            return hash
+        if not filename or '.' not in str(filename):
+            return f'{hash} {id}'
+        return f'{hash} {id}.' + str(filename).split('.')[-1]
 
-        stale_path = path
-        pathdir = self.path + '/bucket/' + '/'.join(splithash) + '/'
-        fullpath = pathdir + filename
+    def object_path(self, name):
+        return os.path.join(self.objectdir, name[0:2], name[2:4], name)
 
-        if not os.path.exists(pathdir):
-            os.makedirs(pathdir, exist_ok=True)
+    def get_filesystem_path(self, hash):
+        with self.lock:
+            self.cur.execute("SELECT data FROM files WHERE hash=?", (hash,))
+            return self.object_path(self.cur.fetchone()[0])
 
-        os.system(f'move -v \"{stale_path}\" \"{path}\"')
+    def exists_filesystem_path(self, path):
+        return os.path.exists(path)
 
-        if not time:
-            time = time.time()
+    def stage(self, stream, length=None):
+        # unique staging names, concurrent downloads never share a file
+        fd, stagepath = tempfile.mkstemp(dir=self.stagedir)
+        md5 = hashlib.md5()
+        written = 0
+
+        try:
+            with os.fdopen(fd, 'wb') as ostream:
+                while True:
+                    data = stream.read(self.buffer_size)
+                    if not data:
+                        break
+                    if self.stopping:
+                        raise InterruptedError('Download interrupted')
+                    md5.update(data)
+                    ostream.write(data)
+                    written += len(data)
+
+            if length is not None and written != int(length):
+                raise ValueError(f'Stream has {written} of {length} bytes')
+        except:
+            os.unlink(stagepath)
+            raise
+
+        return stagepath, md5.hexdigest(), written
 
-        self.cur.execute("INSERT OR REPLACE INTO files(hash, length, filename, time, data) VALUES(?,?,?,?,?)", (hash, length, filename, time, path))
-        self.cur.execute("INSERT OR REPLACE INTO api(url, id, filename, time, hash) VALUES(?,?,?,?,?)", (url, id, filename, time, hash))
-    
-    def get_filesystem_path(self, hash):
-        self.cur.execute("SELECT data FROM files WHERE hash=?", (hash,))
-        return self.cur.fetchone()[0]
+    def insert_stream(self, url, stream, length=None, time=None, id=None, filename=None):
+        if not time:
+            time = time_module.time()
+
+        stagepath, hash, length = self.stage(stream, length)
+        name = self.object_name(hash, id, filename)
+        path = self.object_path(name)
+
+        with self.lock:
+            self.cur.execute("SELECT data FROM files WHERE hash=? LIMIT 1", (hash,))
+            row = self.cur.fetchone()
+
+            if row is None:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(stagepath, path)
+                self.cur.execute("INSERT INTO files(hash, length, filename, time, data, stored) VALUES(?,?,?,?,?,?)", (hash, length, filename, time, name, length))
+                self.unsynced.append(path)
+            else:
+                os.unlink(stagepath)
+
+                # same content under another name shares the inode
+                if name != row[0] and not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    try:
+                        os.link(self.object_path(row[0]), path)
+                        self.unsynced.append(path)
+                    except OSError as e:
+                        print("Failed to link bucket file:", path, e)
+
+            self.insert_mapping(url, hash, time, id, filename)
+
+            if len(self.unsynced) >= self.fsync_batch:
+                self.sync()
 
     def get_stream(self, hash):
-        path = self.get_filesystem_path(hash)
-        #if not self.exists_filesystem_path(self, path):
-        ## just let the exception occur
-        
-        # different than file_bucket, fix?
-        return os.open(path, 'rb')
+        return open(self.get_filesystem_path(hash), 'rb')
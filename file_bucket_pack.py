@@ -0,0 +1,227 @@
+import io
+import os
+import mmap
+import shutil
+import hashlib
+import tempfile
+
+import file_bucket as Filebucket_module
+
+class View_stream(io.RawIOBase):
+    # reads copy straight from the mapped pack into the caller's buffer
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), len(self.view) - self.position)
+        b[:n] = self.view[self.position:self.position + n]
+        self.position += n
+        return n
+
+class Filebucket(Filebucket_module.Filebucket):
+    # objects are appended to large pack files next to the database, bucket.db -> bucket-packs/000001.pack
+    def __init__(self, path, dry_run=False, buffer_size=1048576, workers=0, per_host=2, queue_size=64, compression='none', pack_size=1073741824):
+        self.pack_size = pack_size
+        self.maps = dict()
+        self.writer = None
+        super().__init__(path, dry_run, buffer_size, workers, per_host, queue_size, compression)
+
+    def init(self):
+        super().init()
+        self.cur.execute("CREATE TABLE IF NOT EXISTS packs(id INTEGER PRIMARY KEY, path TEXT)")
+        self.cur.execute("CREATE TABLE IF NOT EXISTS pack_index(hash TEXT PRIMARY KEY, pack INTEGER, offset INTEGER, length INTEGER) WITHOUT ROWID")
+
+        if self.path == ':memory:':
+            self.packdir = tempfile.mkdtemp(suffix='-packs')
+        else:
+            self.packdir = os.path.splitext(os.path.abspath(self.path))[0] + '-packs'
+        os.makedirs(self.packdir, exist_ok=True)
+
+    def save(self):
+        # pack contents reach the disk before the index rows that point at them are committed
+        with self.lock:
+            if self.writer:
+                self.writer[1].flush()
+                os.fsync(self.writer[1].fileno())
+        super().save()
+
+    def close(self):
+        if self.closed:
+            return
+
+        super().close()
+
+        if self.writer:
+            self.writer[1].close()
+            self.writer = None
+
+        for mm in self.maps.values():
+            try:
+                mm.close()
+            except BufferError:
+                pass # views are still held by readers
+        self.maps = dict()
+
+        # an in-memory bucket's packs go with it
+        if self.path == ':memory:':
+            shutil.rmtree(self.packdir, ignore_errors=True)
+
+    def pack_path(self, pack):
+        self.cur.execute("SELECT path FROM packs WHERE id=?", (pack,))
+        return os.path.join(self.packdir, self.cur.fetchone()[0])
+
+    def pack_end(self, pack):
+        self.cur.execute("SELECT COALESCE(MAX(offset + length), 0) FROM pack_index WHERE pack=?", (pack,))
+        return self.cur.fetchone()[0]
+
+    def open_writer(self, length):
+        if self.writer and self.writer[1].tell() + length > self.pack_size and self.writer[1].tell() > 0:
+            self.writer[1].flush()
+            os.fsync(self.writer[1].fileno())
+            self.writer[1].close()
+            self.writer = None
+
+        if self.writer is None:
+            self.cur.execute("SELECT MAX(id) FROM packs")
+            pack = self.cur.fetchone()[0]
+
+            # anything past the last indexed object was never committed
+            if pack is not None and self.pack_end(pack) + length <= self.pack_size:
+                f = open(self.pack_path(pack), 'r+b')
+                f.truncate(self.pack_end(pack))
+                f.seek(0, os.SEEK_END)
+            else:
+                self.cur.execute("INSERT INTO packs(path) VALUES(NULL)")
+                pack = self.cur.lastrowid
+                self.cur.execute("UPDATE packs SET path=? WHERE id=?", (f'{pack:06}.pack', pack))
+                f = open(self.pack_path(pack), 'w+b')
+
+            self.writer = (pack, f)
+
+        return self.writer
+
+    def append(self, chunks, length):
+        pack, f = self.open_writer(length)
+        offset = f.tell()
+        md5 = hashlib.md5()
+        written = 0
+
+        try:
+            for data in chunks:
+                if written + len(data) > length:
+                    raise ValueError(f'Stream is longer than {length} bytes')
+                f.write(data)
+                md5.update(data)
+                written += len(data)
+
+            if written != length:
+                raise ValueError(f'Stream ended after {written} of {length} bytes')
+        except:
+            f.truncate(offset)
+            f.seek(offset)
+            raise
+
+        return pack, offset, md5.hexdigest()
+
+    def write_blob(self, stream, length, filename, time):
+        pack, offset, hash = self.append(Filebucket_module.read_chunks(None, stream, self.buffer_size), length)
+
+        # duplicate content is dropped from the end of the pack again
+        if self.hash_exists(hash):
+            self.writer[1].truncate(offset)
+            self.writer[1].seek(offset)
+            return hash
+
+        self.cur.execute("INSERT INTO files(hash, length, filename, time, data, stored) VALUES(?,?,?,?,NULL,?)", (hash, length, filename, time, length))
+        self.cur.execute("INSERT INTO pack_index(hash, pack, offset, length) VALUES(?,?,?,?)", (hash, pack, offset, length))
+        return hash
+
+    def get_map(self, pack, end):
+        mm = self.maps.get(pack)
+
+        # packs grow while they are written, an old map stays alive for views still using it
+        if mm is None or len(mm) < end:
+            with open(self.pack_path(pack), 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[pack] = mm
+
+        return mm
+
+    def get_view(self, hash):
+        with self.lock:
+            self.cur.execute("SELECT pack, offset, length FROM pack_index WHERE hash=?", (hash,))
+            row = self.cur.fetchone()
+
+            if row is None:
+                return None
+
+            pack, offset, length = row
+
+            if length == 0:
+                return memoryview(b'')
+
+            if self.writer and self.writer[0] == pack:
+                self.writer[1].flush()
+
+            return memoryview(self.get_map(pack, offset + length))[offset:offset + length]
+
+    def get_stream(self, hash):
+        view = self.get_view(hash)
+
+        # rows stored before the bucket used packs
+        if view is None:
+            return super().get_stream(hash)
+
+        return View_stream(view)
+
+    def pack_usage(self):
+        # objects whose files row was removed are garbage
+        self.cur.execute("DELETE FROM pack_index WHERE hash NOT IN (SELECT hash FROM files WHERE hash IS NOT NULL)")
+        self.cur.execute("SELECT packs.id, COALESCE(SUM(pack_index.length), 0) FROM packs LEFT JOIN pack_index ON pack_index.pack = packs.id GROUP BY packs.id ORDER BY packs.id")
+        return [(pack, os.path.getsize(self.pack_path(pack)), live) for pack, live in self.cur.fetchall()]
+
+    def repack(self, threshold=0.25):
+        if self.dry_run:
+            print("Repack needs to commit, not running in dry run")
+            return 0
+
+        with self.lock:
+            # live objects are appended to the newest pack, which is never repacked itself
+            current = self.open_writer(0)[0]
+            reclaimed = 0
+
+            for pack, size, live in self.pack_usage():
+                if pack == current or size == 0 or (size - live) / size < threshold:
+                    continue
+
+                print(f"Repacking {pack}: {live}/{size} bytes live")
+
+                self.cur.execute("SELECT hash, offset, length FROM pack_index WHERE pack=? ORDER BY offset", (pack,))
+                objects = self.cur.fetchall()
+                mm = self.get_map(pack, size) if size else None
+
+                for hash, offset, length in objects:
+                    view = memoryview(mm)[offset:offset + length]
+                    new_pack, new_offset, _ = self.append([view], length)
+                    view.release()
+                    self.cur.execute("UPDATE pack_index SET pack=?, offset=? WHERE hash=?", (new_pack, new_offset, hash))
+
+                path = self.pack_path(pack)
+                self.cur.execute("DELETE FROM packs WHERE id=?", (pack,))
+
+                # the old pack is only removed once the moved index rows are committed
+                self.save()
+
+                self.maps.pop(pack, None)
+                try:
+                    mm.close()
+                except BufferError:
+                    pass
+                os.unlink(path)
+                reclaimed += size - live
+
+            return reclaimed
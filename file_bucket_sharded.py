@@ -0,0 +1,111 @@
+import os
+import time as time_module
+
+import file_bucket as Filebucket_module
+
+class Filebucket(Filebucket_module.Filebucket):
+    # the bucket path is a catalog of urls and shards, content lives in one shard database per hash prefix
+    def __init__(self, path, dry_run=False, buffer_size=1048576, workers=0, per_host=2, queue_size=64, compression='none', shards=16):
+        self.shard_count = shards
+        self.shards = []
+        super().__init__(path, dry_run, buffer_size, workers, per_host, queue_size, compression)
+
+    def init(self):
+        self.init_api()
+        self.cur.execute("CREATE TABLE IF NOT EXISTS shards(id INTEGER PRIMARY KEY, path TEXT)")
+        self.cur.execute("CREATE TABLE IF NOT EXISTS partials(url TEXT PRIMARY KEY, path, offset INTEGER, length INTEGER, validator, time)")
+
+        self.cur.execute("SELECT id, path FROM shards ORDER BY id")
+        rows = self.cur.fetchall()
+
+        # relative paths are next to the catalog, rows can be edited to move a shard to another disk
+        if not rows:
+            name = os.path.splitext(os.path.basename(self.path))[0]
+            rows = [(i, f'{name}-shard-{i:02}.db') for i in range(self.shard_count)]
+            self.cur.executemany("INSERT INTO shards(id, path) VALUES(?,?)", rows)
+            if not self.dry_run:
+                self.con.commit()
+
+        if len(rows) != self.shard_count:
+            print(f"Bucket has {len(rows)} shards, the shard count is fixed when the catalog is created")
+
+        self.shards = [Filebucket_module.Filebucket(self.shard_path(path), self.dry_run, self.buffer_size, compression=self.compression) for _, path in rows]
+
+    def shard_path(self, path):
+        if self.path == ':memory:':
+            return ':memory:'
+        return os.path.join(os.path.dirname(os.path.abspath(self.path)), path)
+
+    def route(self, hash):
+        return self.shards[int(hash[:8], 16) % len(self.shards)]
+
+    def save(self):
+        # content is committed before the catalog points at it
+        for shard in self.shards:
+            shard.save()
+        super().save()
+
+    def close(self):
+        if self.closed:
+            return
+
+        super().close()
+        for shard in self.shards:
+            shard.close()
+
+    def insert_stream(self, url, stream, length = None, time = None, id = None, filename = None):
+        # the shard is picked by content hash, so the content is hashed before it is written
+        if not time:
+            time = time_module.time()
+
+        if not stream.seekable():
+            spool, length = self.spool(stream)
+            with spool:
+                return self.insert_stream(url, spool, length, time, id, filename)
+
+        start = stream.tell()
+        shard = self.route(self.get_hash(stream))
+        stream.seek(start)
+
+        if length is None:
+            length = stream.seek(0, os.SEEK_END) - start
+            stream.seek(start)
+
+        # writers to different shards run in parallel, only the url mapping takes the catalog lock
+        with shard.lock:
+            hash = shard.write_blob(stream, int(length), filename, time)
+
+        with self.lock:
+            self.insert_mapping(url, hash, time, id, filename)
+
+    def find_known_hash(self, hashes, length = None):
+        for entry in hashes or []:
+            if entry.get('algo') != 2 or not entry.get('value'):
+                continue
+
+            shard = self.route(entry['value'].lower())
+            with shard.lock:
+                hash, known_length = shard.find_known_hash([entry], length)
+
+            if hash:
+                return hash, known_length
+
+        return None, None
+
+    def hash_exists(self, hash):
+        shard = self.route(hash)
+        with shard.lock:
+            return shard.hash_exists(hash)
+
+    def get_stream(self, hash):
+        return self.route(hash).get_stream(hash)
+
+    def report_storage(self):
+        for shard in self.shards:
+            for kind, stats in shard.storage_stats.items():
+                totals = self.storage_stats.setdefault(kind, [0, 0, 0])
+                for i, value in enumerate(stats):
+                    totals[i] += value
+            shard.storage_stats = dict()
+
+        super().report_storage()
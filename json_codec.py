@@ -0,0 +1,108 @@
+import json
+from typing import Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+codecs = ['auto', 'orjson', 'msgspec', 'stdlib']
+
+name = 'stdlib'
+
+def available(codec):
+    return codec in ['auto', 'stdlib'] or (codec == 'orjson' and orjson is not None) or (codec == 'msgspec' and msgspec is not None)
+
+def stdlib_loads(data):
+    return json.loads(data)
+
+def stdlib_dumps(value):
+    return json.dumps(value)
+
+def orjson_dumps(value):
+    return orjson.dumps(value).decode()
+
+def msgspec_dumps(value):
+    return msgspec.json.encode(value).decode()
+
+loads = stdlib_loads
+dumps = stdlib_dumps
+
+def set_codec(codec='auto'):
+    global name, loads, dumps
+
+    if codec == 'auto':
+        codec = 'orjson' if orjson else 'msgspec' if msgspec else 'stdlib'
+
+    if not available(codec):
+        raise ValueError(f'Json codec {codec} is not available')
+
+    name = codec
+
+    if codec == 'orjson':
+        loads, dumps = orjson.loads, orjson_dumps
+    elif codec == 'msgspec':
+        loads, dumps = msgspec.json.decode, msgspec_dumps
+    else:
+        loads, dumps = stdlib_loads, stdlib_dumps
+
+# typed stubs hold only the fields the crawler reads
+
+mod_fields = ('id', 'slug', 'dateModified')
+file_fields = ('id', 'modId', 'fileName', 'fileDate', 'downloadUrl', 'fileLength')
+
+class Mod_stub:
+    __slots__ = mod_fields
+
+    def __init__(self, id=None, slug=None, dateModified=None):
+        self.id = id
+        self.slug = slug
+        self.dateModified = dateModified
+
+class File_stub:
+    __slots__ = file_fields
+
+    def __init__(self, id=None, modId=None, fileName=None, fileDate=None, downloadUrl=None, fileLength=None):
+        self.id = id
+        self.modId = modId
+        self.fileName = fileName
+        self.fileDate = fileDate
+        self.downloadUrl = downloadUrl
+        self.fileLength = fileLength
+
+if msgspec is not None:
+    # msgspec skips unknown fields without building them
+    class Mod_struct(msgspec.Struct):
+        id: Optional[int] = None
+        slug: Optional[str] = None
+        dateModified: Optional[str] = None
+
+    class File_struct(msgspec.Struct):
+        id: Optional[int] = None
+        modId: Optional[int] = None
+        fileName: Optional[str] = None
+        fileDate: Optional[str] = None
+        downloadUrl: Optional[str] = None
+        fileLength: Optional[int] = None
+
+    mod_decoder = msgspec.json.Decoder(Mod_struct)
+    file_decoder = msgspec.json.Decoder(File_struct)
+
+def decode_stub(data, stub_class, fields):
+    value = loads(data)
+    return stub_class(**{key: value.get(key) for key in fields})
+
+def decode_mod(data):
+    if msgspec is not None and name != 'stdlib':
+        return mod_decoder.decode(data)
+    return decode_stub(data, Mod_stub, mod_fields)
+
+def decode_file(data):
+    if msgspec is not None and name != 'stdlib':
+        return file_decoder.decode(data)
+    return decode_stub(data, File_stub, file_fields)
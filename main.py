@@ -1,7 +1,7 @@
 #!/bin/python3
 
 import time
-import json
+import collections
 import importlib
 import argparse
 import os
@@ -9,14 +9,19 @@ import signal
 import sys
 import threading
 import sqlite3
-import re
 
-import config, sqlite_helper, api_helper
+import config, sqlite_helper, api_helper, time_helper, json_codec, pipeline, compression
 
+json_codec.set_codec(config.json_codec)
 file_bucket = importlib.import_module(config.bucket_module)
 
-db = sqlite_helper.Sqlite_helper(config.db_filepath, config.dry_run)
-bucket = file_bucket.Filebucket(config.bucket_filepath, config.dry_run)
+for codec in [config.cache_compression, config.bucket_compression]:
+    if not compression.available(codec):
+        print(f"Compression codec {codec} is not available")
+        sys.exit(1)
+
+db = sqlite_helper.Sqlite_helper(config.db_filepath, config.dry_run, config.request_cache_size, config.cache_compression, config.compression_level, config.synchronous, config.commit_rows, config.commit_seconds)
+bucket = file_bucket.Filebucket(config.bucket_filepath, config.dry_run, config.download_buffer, config.download_workers, config.download_per_host, config.download_queue, config.bucket_compression)
 api = api_helper.Api_helper(db, config)
 
 hour = 3600
@@ -29,6 +34,19 @@ year = week * 52
 target_games = config.game_filter
 target_categories = config.category_filter
 
+seen_mods = set()
+queued_mods = set()
+changelog_files = set()
+
+# an unfinished run from the last day resumes from its crawl frontier
+if db.start_run(day):
+    print("Resuming crawl run", db.run_id)
+    seen_mods.update(db.get_seen())
+
+# mods queued by iterate_mods in id order, the checkpoint follows the lowest unfinished one
+mod_order = collections.deque()
+finished_mods = set()
+
 interrupt_loop = False
 busy_lock = threading.RLock() # signals interrupt main thread, use reentrant
 
@@ -36,14 +54,14 @@ def retrieve_games():
     global target_games
     append = len(target_games) == 0
     for result in api_helper.Depaginator(api, '/games', time_diff=week):
-        for game_stub in result['data']:
+        for game_stub, game_raw in result.data_items():
             if interrupt_loop:
                 return
             
-            db.insert_game(game_stub)
+            db.insert_game(game_stub, game_raw)
 
             if config.download_media:
-                dateModified = api.read_time(game_stub['dateModified'])
+                dateModified = time_helper.parse_epoch(game_stub['dateModified'])
                 assets = game_stub['assets']
                 if assets:
                     bucket.try_insert_url(assets['iconUrl'], dateModified)
@@ -54,209 +72,420 @@ def retrieve_games():
                 target_games.append(game_stub['id'])
 
 def iterate_games():
+    pending = []
+
     for game_id in target_games:
         if interrupt_loop:
-            return
+            break
 
         if config.scrape_game_versions:
-            api.get_json(f'/games/{game_id}/versions', write=True, use_local=True, time_diff=month)
+            pending.append(api.submit_json(f'/games/{game_id}/versions', write=True, use_local=True, time_diff=month))
+
+    api.collect(pending)
 
 def retrieve_categories():
     global target_categories
     append = len(target_categories) == 0
     for game_id in target_games:
         for result in api_helper.Depaginator(api, f'/categories?gameId={game_id}', time_diff=week):
-            for category_stub in result['data']:
+            for category_stub, category_raw in result.data_items():
                 if interrupt_loop:
                     return
 
-                db.insert_category(category_stub)
+                db.insert_category(category_stub, category_raw)
 
                 if config.download_media:
-                    dateModified = api.read_time(category_stub['dateModified'])
+                    dateModified = time_helper.parse_epoch(category_stub['dateModified'])
                     bucket.try_insert_url(category_stub['iconUrl'], dateModified)
 
                 if append:
                     target_categories.append(category_stub['id'])
 
+def phase_done(name):
+    checkpoint = db.get_checkpoint('phase:' + name)
+    return checkpoint is not None and checkpoint[0] == 'done'
+
+def finish_phase(name):
+    if not interrupt_loop:
+        db.checkpoint('phase:' + name, 'done')
+
 def iterate_categories():
     for category_id in target_categories:
+        scope = f'category:{category_id}'
+        checkpoint = db.get_checkpoint(scope)
+
+        if checkpoint and checkpoint[0] == 'done':
+            continue
+
         # Iterate category list
         db.cur.execute('SELECT gameId FROM categories WHERE id=?', (category_id,))
         game_id = db.cur.fetchone()[0]
         url = f'/mods/search?categoryId={category_id}&gameId={game_id}&sortField=3&sortOrder=desc'
         stale_threshold = 0
+        start_index = checkpoint[1] if checkpoint else 0
+
+        if start_index:
+            print(f'Resuming category {category_id} at index {start_index}')
         
         # Stale in a day or less
-        for result in api_helper.Depaginator(api, url, time_diff=day):
+        depag = api_helper.Depaginator(api, url, index=start_index, time_diff=day)
+
+        for result in depag:
             stale_count = 0
+            ids = [mod_stub['id'] for mod_stub in result['data']]
+            stored_dates = db.get_mod_times(ids)
+            fetched_times = db.get_files_fetched(ids) if crawl else {}
+            latest = dict()
 
-            for mod_stub in result['data']:
+            for mod_stub, mod_raw in result.data_items():
                 if interrupt_loop:
                     return
+
+                seen_mods.add(mod_stub['id'])
                 
                 # Iterate search listing for addon ids
-                if not db.field_exists('mods', mod_stub['id']):
-                    db.insert_mod(mod_stub)
-                    continue
-                
-                db.cur.execute('SELECT json FROM mods WHERE id=?', (mod_stub['id'],))
-                stale_stub = json.loads(db.cur.fetchone()[0])
+                stale_date = stored_dates.get(mod_stub['id'])
 
-                mod_date_json = mod_stub['dateModified']
-                stale_date_json = stale_stub['dateModified']
+                mod_date = time_helper.parse_epoch(mod_stub['dateModified'])
 
-                mod_date = api.read_time(mod_date_json)
-                stale_date = api.read_time(stale_date_json)
+                if stale_date is None or mod_date > stale_date:
+                    db.insert_mod(mod_stub, mod_raw)
 
-                if mod_date > stale_date:
-                    db.insert_mod(mod_stub)
+                    # changed mods go straight to the files stage, listed ones only back to their previous listing
+                    if crawl:
+                        since = fetched_times.get(mod_stub['id'], 0)
+                        if enqueue_mod(mod_stub, mod_date, since) and since:
+                            latest.update(latest_files(mod_stub))
                     continue
 
                 stale_count += 1
 
+            if crawl:
+                submit_latest(latest)
+                crawl.pump(block=False)
+
+            db.mark_seen(ids)
+            db.checkpoint(scope, 'search', page_index=depag.index + depag.pageSize)
+
             print('Stale count:', stale_count, 'Result count:', len(result['data']), 'Threshold:', stale_threshold)
 
             if stale_count == len(result['data']) and not config.full:
                 if stale_threshold > 1:
                     print("All mods were stale, breaking")
+                    depag.close()
                     break
                 else:
                     stale_threshold += 1
 
-def ismodurl(url):
-    reg = re.compile('^/mods/[0-9]+.*')
-    return reg.search(url) is not None
+        if not interrupt_loop:
+            db.checkpoint(scope, 'done')
 
-def getmodid(url):
-    reg = re.compile('^/mods/([0-9]+)')
-    return reg.search(url).group(1)
+    if crawl:
+        crawl.drain(lambda: interrupt_loop)
 
-def getmodtime(json_raw):
-    j = json.loads(json_raw)
-    return api.read_time(j['dateModified'])
+def refresh_mods():
+    # stale mods with an earlier files listing, handled in groups of batch_size so memory stays bounded
+    if config.full:
+        print('Full run lists every mod page by page')
+        return
 
-def iterate_mods():
-    db.con.create_function('ISMODURL', 1, ismodurl)
-    db.con.create_function('GETMODID', 1, getmodid)
-    db.con.create_function('GETMODTIME', 1, getmodtime)
-    
-    cur_2 = db.con.cursor()
-    modifications = 0
-    old_check = False
-
-    # accumulate all mods that require a fetch
-    cur_2.execute("ATTACH DATABASE ':memory:' AS dbtemp")
-    cur_2.execute("CREATE TABLE dbtemp.api_calls(url,time,json)")
-    cur_2.execute("CREATE TABLE dbtemp.stale_mods(id INTEGER PRIMARY KEY,name,slug,gameId,json,upstream_time,downstream_time)")
-
-    print("Extracting most recent API calls")
-    cur_2.execute("INSERT INTO dbtemp.api_calls SELECT * FROM (SELECT * FROM (SELECT GETMODID(url) AS 'url',time,'' AS 'json' FROM api WHERE ISMODURL(url)) GROUP BY url HAVING MAX(time))")
-
-    print("Generating list of out-of-date mods")
-    cur_2.execute('INSERT INTO dbtemp.stale_mods SELECT * FROM (SELECT mods.id,mods.name,mods.slug,mods.gameId,mods.json,GETMODTIME(mods.json),dbtemp.api_calls.time FROM mods INNER JOIN dbtemp.api_calls ON dbtemp.api_calls.url=mods.id WHERE GETMODTIME(mods.json) > dbtemp.api_calls.time)')
-    
-    cur_2.execute('SELECT COUNT(*) FROM dbtemp.stale_mods')
-    print(f'Fetching {cur_2.fetchone()[0]} mods')
-
-    cur_2.execute('SELECT * FROM dbtemp.stale_mods')
-    for row in cur_2:
+    print(f'Refreshing {db.count_stale_mods(listed=True)} stale mods in batches of {config.batch_size}')
+
+    group = []
+
+    for row in db.iterate_stale_mods(listed=True):
         if interrupt_loop:
             return
-        
-        json_data = None
-        url = None
-        modify_time = None
-        last_request = None
-        depag = None
-
-        if old_check:
-            # Iterate addons for addon files
-            json_data = json.loads(row[5])
-            url = f'/mods/{json_data["id"]}/files?'
-            depag = api_helper.Depaginator(api, url, use_local=False)
-
-            modify_time = api.read_time(json_data['dateModified'])
-            last_request = api.when_last_request(depag.current_url)
-
-            if modify_time < last_request and not config.full:
-                print(f'{json_data["id"]}.', end='', flush=True)
-                continue
-        else:
-            db.cur.execute('SELECT * FROM mods WHERE id=? LIMIT 1', (row[0],))
-            _r = db.cur.fetchone()
-            json_data = json.loads(_r[5])
-            url = f'/mods/{json_data["id"]}/files?'
-            depag = api_helper.Depaginator(api, url, use_local=False)
-
-            modify_time = api.read_time(json_data['dateModified'])
-            last_request = api.when_last_request(depag.current_url)
 
+        group.append(row)
+
+        if len(group) >= config.batch_size:
+            refresh_group(group)
+            group = []
+
+    if group and not interrupt_loop:
+        refresh_group(group)
+
+    if crawl:
+        crawl.drain(lambda: interrupt_loop)
+
+def refresh_group(rows):
+    # mods queued from search pages were listed this run
+    if crawl:
+        rows = [row for row in rows if row[0] not in queued_mods]
+
+    # mod id -> (stub, files_fetched_at)
+    mods = {mod_id: (json_codec.loads(json_raw), fetched_at) for mod_id, json_raw, modify_time, fetched_at in rows}
+
+    # stubs this run's search pages did not return may be older than upstream
+    mod_ids = [mod_id for mod_id in mods if mod_id not in seen_mods]
+
+    for batch, result in api.iterate_batches('/mods', 'modIds', mod_ids):
+        if result is None:
+            continue
+
+        for mod_stub, mod_raw in result.data_items():
+            if mod_stub['id'] in mods:
+                db.insert_mod(mod_stub, mod_raw)
+                mods[mod_stub['id']] = (mod_stub, mods[mod_stub['id']][1])
+
+    fetch_latest_files([json_data for json_data, fetched_at in mods.values()])
+
+    # latest files are one per game version and loader, uploads in between only show up in the files pages
+    for mod_id, (json_data, fetched_at) in mods.items():
+        if interrupt_loop:
+            return
+
+        modify_time = time_helper.parse_epoch(json_data['dateModified'])
+
+        if crawl:
+            enqueue_mod(json_data, modify_time, fetched_at)
+            continue
+
+        pending = []
+        fetch_time = time.time()
 
         if config.scrape_descriptions:
-            api.get_json(f'/mods/{json_data["id"]}/description', write=True, use_local=True, time_diff=week)
+            submit_text(f'/mods/{mod_id}/description', pending)
 
-        if config.download_media:
-            logo = json_data['logo']
-            screenshots = json_data['screenshots']
-            authors = json_data['authors']
+        mod_media(json_data, modify_time)
 
-            if logo:
-                bucket.try_insert_url(logo['url'], modify_time, None, logo['id'], logo['title'])
-                bucket.try_insert_url(logo['thumbnailUrl'], modify_time, None, logo['id'], logo['title'])
+        print(f'Updating files for {json_data["slug"]} ({mod_id}) since {fetched_at}')
 
-            if authors:
-                for author in authors:
-                    if 'avatarUrl' in author:
-                        bucket.try_insert_url(author['avatarUrl'], modify_time, None, author['id'], None)
+        listed = list_files(json_data, fetched_at, pending)
+        api.collect(pending)
 
-            if screenshots:
-                for screenshot in screenshots:
-                    bucket.try_insert_url(screenshot['url'], modify_time, None, screenshot['id'], None)
-                    bucket.try_insert_url(screenshot['thumbnailUrl'], modify_time, None, screenshot['id'], None)
+        if listed:
+            db.mark_files_fetched(mod_id, fetch_time)
 
-        print(f'Updating files for {json_data["slug"]} ({json_data["id"]}) ({modify_time} >= {last_request} (up/down) ({last_request - modify_time}))')
+def latest_files(json_data):
+    # file id -> mod for the newest file of each game version and loader
+    ids = [index['fileId'] for index in json_data.get('latestFilesIndexes') or []]
+    ids += [file_stub['id'] for file_stub in json_data.get('latestFiles') or []]
+    return {file_id: json_data for file_id in ids}
 
-        for result in depag:
-            for file_stub in result['data']:
-                db.insert_file(file_stub)
-                file_time = api.read_time(file_stub['fileDate'])
+def fetch_latest_files(mods):
+    # the latest files are fetched in bulk and refresh stored metadata
+    files = dict()
+    pending = []
+
+    for json_data in mods:
+        for file_id, mod in latest_files(json_data).items():
+            files.setdefault(file_id, mod)
+
+    for batch, result in api.iterate_batches('/mods/files', 'fileIds', list(files)):
+        if result is None:
+            continue
+
+        for file_stub, file_raw in result.data_items():
+            if interrupt_loop:
+                return
+
+            mod_file(files[file_stub['id']], file_stub, file_raw, pending)
+
+    api.collect(pending)
+
+def submit_latest(files):
+    file_ids = list(files)
+
+    for i in range(0, len(file_ids), config.batch_size):
+        crawl.submit(latest_stage, files, '/mods/files', body={'fileIds': file_ids[i:i + config.batch_size]})
+
+def handle_latest(files, result):
+    if interrupt_loop or result is None:
+        return
+
+    for file_stub, file_raw in result.data_items():
+        mod_file(files[file_stub['id']], file_stub, file_raw, None)
+
+def listed_before(result, since):
+    # files pages are newest first, files can be approved well after their fileDate so the walk overlaps a week
+    return any(time_helper.parse_epoch(file_stub['fileDate']) <= since - week for file_stub in result['data'])
+
+def list_files(json_data, since, pending):
+    # every files page, or with since only back to the last listing, returns False when a page failed
+    depag = api_helper.Depaginator(api, f'/mods/{json_data["id"]}/files?', use_local=False, prefetch=0 if since else None)
+
+    for result in depag:
+        for file_stub, file_raw in result.data_items():
+            mod_file(json_data, file_stub, file_raw, pending)
 
-                if config.scrape_changelogs:
-                    api.get_json(f'/mods/{json_data["id"]}/files/{file_stub["id"]}/changelog', write=True, use_local=True, time_diff=week)
+        if since and listed_before(result, since):
+            depag.close()
+            break
 
-                if config.download_files:
-                    bucket.try_insert_url(file_stub['downloadUrl'], file_time, file_stub['fileLength'], file_stub['id'], file_stub['fileName'])
+    return not depag.failed
 
-        modifications += 1
+def submit_text(url, pending):
+    if crawl:
+        crawl.submit(text_stage, None, url, write=True, use_local=True, time_diff=week)
+    else:
+        pending.append(api.submit_json(url, write=True, use_local=True, time_diff=week))
 
-        if modifications > 20:
-            db.save()
-            modifications = 0
+def mod_media(json_data, modify_time):
+    if not config.download_media:
+        return
+
+    logo = json_data['logo']
+    screenshots = json_data['screenshots']
+    authors = json_data['authors']
+
+    if logo:
+        bucket.try_insert_url(logo['url'], modify_time, None, logo['id'], logo['title'])
+        bucket.try_insert_url(logo['thumbnailUrl'], modify_time, None, logo['id'], logo['title'])
+
+    if authors:
+        for author in authors:
+            if 'avatarUrl' in author:
+                bucket.try_insert_url(author['avatarUrl'], modify_time, None, author['id'], None)
+
+    if screenshots:
+        for screenshot in screenshots:
+            bucket.try_insert_url(screenshot['url'], modify_time, None, screenshot['id'], None)
+            bucket.try_insert_url(screenshot['thumbnailUrl'], modify_time, None, screenshot['id'], None)
+
+def mod_file(json_data, file_stub, file_raw, pending):
+    db.insert_file(file_stub, file_raw)
+    file_time = time_helper.parse_epoch(file_stub['fileDate'])
+
+    # latest files can come from a bulk request and a files page in the same run
+    if config.scrape_changelogs and file_stub['id'] not in changelog_files:
+        changelog_files.add(file_stub['id'])
+        submit_text(f'/mods/{json_data["id"]}/files/{file_stub["id"]}/changelog', pending)
+
+    if config.download_files:
+        bucket.try_insert_url(file_stub['downloadUrl'], file_time, file_stub['fileLength'], file_stub['id'], file_stub['fileName'], file_stub['hashes'])
+
+def files_url(mod_id, index):
+    return f'/mods/{mod_id}/files?index={index}&pageSize=50'
+
+def enqueue_mod(json_data, modify_time, since=0):
+    # file listings go to the files stage while the caller keeps walking
+    if json_data['id'] in queued_mods:
+        return False
+
+    queued_mods.add(json_data['id'])
+
+    if config.scrape_descriptions:
+        submit_text(f'/mods/{json_data["id"]}/description', None)
+
+    mod_media(json_data, modify_time)
+
+    print(f'Queueing files for {json_data["slug"]} ({json_data["id"]})')
+    crawl.submit(file_stage, (json_data, 0, time.time(), since), files_url(json_data['id'], 0))
+    return True
+
+def finish_mod(mod_id):
+    if not mod_order:
+        return
+
+    finished_mods.add(mod_id)
+    last_id = None
+
+    while mod_order and mod_order[0] in finished_mods:
+        last_id = mod_order.popleft()
+        finished_mods.discard(last_id)
+
+    if last_id is not None:
+        db.checkpoint('mods', 'files', last_id=last_id)
+
+def handle_files(context, result):
+    json_data, index, fetch_time, since = context
+
+    if interrupt_loop:
+        return
+
+    # a failed page leaves the mod stale for the next run
+    if result is None:
+        finish_mod(json_data['id'])
+        return
+
+    for file_stub, file_raw in result.data_items():
+        mod_file(json_data, file_stub, file_raw, None)
+
+    pagination = result.get('pagination')
+    index += 50
+
+    if pagination and index < pagination['totalCount'] and not (since and listed_before(result, since)):
+        crawl.submit(file_stage, (json_data, index, fetch_time, since), files_url(json_data['id'], index))
+    else:
+        db.mark_files_fetched(json_data['id'], fetch_time)
+        finish_mod(json_data['id'])
+
+crawl = None
+
+if config.pipeline:
+    crawl = pipeline.Pipeline(api)
+    file_stage = crawl.stage('files', config.pipeline_files, handle_files)
+    text_stage = crawl.stage('texts', config.pipeline_texts)
+    latest_stage = crawl.stage('latest', 1, handle_latest)
+
+def iterate_mods():
+    # mods with an earlier listing were refreshed in bulk, unless this is a full run
+    listed = None if config.full else False
+
+    print(f'Fetching {db.count_stale_mods(config.full, listed)} mods')
+
+    checkpoint = db.get_checkpoint('mods')
+    last_id = checkpoint[2] if checkpoint else -1
+
+    if checkpoint:
+        print(f'Resuming mods after id {last_id}')
+
+    for mod_id, json_raw, modify_time, last_request in db.iterate_stale_mods(config.full, last_id=last_id, listed=listed):
+        if interrupt_loop:
+            break
+
+        json_data = json_codec.loads(json_raw)
+
+        if crawl:
+            if enqueue_mod(json_data, modify_time):
+                mod_order.append(mod_id)
+            continue
+
+        # Iterate addons for addon files
+        fetch_time = time.time()
+
+        pending = []
+
+        if config.scrape_descriptions:
+            submit_text(f'/mods/{json_data["id"]}/description', pending)
+
+        mod_media(json_data, modify_time)
+
+        print(f'Updating files for {json_data["slug"]} ({json_data["id"]}) ({modify_time} >= {last_request} (up/down) ({last_request - modify_time}))')
+
+        listed = list_files(json_data, 0, pending)
+        api.collect(pending)
+
+        if listed:
+            db.mark_files_fetched(mod_id, fetch_time)
+
+        db.checkpoint('mods', 'files', last_id=mod_id)
+
+    if crawl:
+        crawl.drain(lambda: interrupt_loop)
 
 # could be improved
 
 def signal_handler(sig, frame):
-    global interrupt_loop, busy_lock
+    # the handler runs on the main thread, possibly inside a bucket or queue lock, so it only sets flags
+    # the phases below stop at their next check and the final block saves and closes
+    global interrupt_loop
     print("Caught kill signal, interrupting loop")
     interrupt_loop = True
-    with busy_lock: #this way the resources are frozen until we exit safely
-        print("Saving progress, releasing held resources, and exiting")
-        # Currently these actions are implied
-        # db.close()
-        # bucket.close()
-        sys.exit(0)
+    bucket.interrupt()
 
 for sig in [signal.SIGINT, signal.SIGTERM, signal.SIGQUIT]:
     signal.signal(sig, signal_handler)
 
 with busy_lock:
-    if 'game_retrieve' not in config.skip:
+    if 'game_retrieve' not in config.skip and not interrupt_loop:
         print('Game Retrieval')
         retrieve_games()
 
 with busy_lock:
-    if 'category_retrieve' not in config.skip:
+    if 'category_retrieve' not in config.skip and not interrupt_loop:
         print('Category Retrieval')
         retrieve_categories()
 
@@ -270,14 +499,15 @@ with busy_lock:
         db.save()
 
 with busy_lock:
-    if 'game_iterate' not in config.skip:
+    if 'game_iterate' not in config.skip and not interrupt_loop:
         print('Game Iteration')
         iterate_games()
 
 with busy_lock:
-    if 'category_iterate' not in config.skip:
+    if 'category_iterate' not in config.skip and not interrupt_loop and not phase_done('category_iterate'):
         print('Category Iteration')
         iterate_categories()
+        finish_phase('category_iterate')
 
 with busy_lock:
     if not config.dry_run:
@@ -285,14 +515,32 @@ with busy_lock:
         db.save()
 
 with busy_lock:
-    if 'mod_iterate' not in config.skip:
+    if 'mod_refresh' not in config.skip and not interrupt_loop and not phase_done('mod_refresh'):
+        print('Mod Refresh')
+        refresh_mods()
+        finish_phase('mod_refresh')
+
+with busy_lock:
+    if not config.dry_run:
+        print('Save Progress')
+        db.save()
+
+with busy_lock:
+    if 'mod_iterate' not in config.skip and not interrupt_loop:
         print('Mod Iteration')
         iterate_mods()
 
 with busy_lock:
+    if not interrupt_loop:
+        db.finish_run()
+
     if not config.dry_run:
         print('Save Progress')
         db.save()
 
 with busy_lock:
+    if crawl:
+        crawl.close()
+    api.close()
+    bucket.close()
     print("Done")
\ No newline at end of file
@@ -0,0 +1,57 @@
+#!/bin/python3
+
+import os
+import sys
+import time
+import hashlib
+import importlib
+
+import config
+import file_bucket_chunked
+
+if not os.path.isfile(config.bucket_filepath):
+    print(f"Need path to bucket (from args: {config.bucket_filepath})")
+    sys.exit(1)
+
+file_bucket = importlib.import_module(config.bucket_module)
+bucket = file_bucket.Filebucket(config.bucket_filepath, dry_run=True)
+chunker = file_bucket_chunked.Chunker(config.chunk_size)
+
+def sizeof_fmt(num, suffix="B"):
+    for unit in ("", "Ki", "Mi", "Gi", "Ti", "Pi", "Ei", "Zi"):
+        if abs(num) < 1024.0:
+            return f"{num:3.1f}{unit}{suffix}"
+        num /= 1024.0
+    return f"{num:.1f}Yi{suffix}"
+
+bucket.cur.execute('SELECT COUNT(*), COALESCE(SUM(files.length), 0) FROM api JOIN files ON files.hash = api.hash')
+url_count, url_bytes = bucket.cur.fetchone()
+
+bucket.cur.execute('SELECT hash, length FROM files WHERE hash IS NOT NULL')
+files = bucket.cur.fetchall()
+file_bytes = sum(length or 0 for _, length in files)
+
+print(f"Chunking {len(files)} files ({sizeof_fmt(file_bytes)}) with {sizeof_fmt(chunker.avg_size)} average chunks")
+
+# 96 bit truncated digests keep the set small, collisions are negligible
+chunks = {}
+chunk_count = 0
+start = time.perf_counter()
+
+for counter, (hash, length) in enumerate(files, 1):
+    with bucket.get_stream(hash) as stream:
+        for chunk in chunker.chunks(stream):
+            chunks[hashlib.sha1(chunk).digest()[:12]] = len(chunk)
+            chunk_count += 1
+
+    if counter % 100 == 0:
+        print(f"\r{counter}/{len(files)}", end='', flush=True)
+
+elapsed = time.perf_counter() - start
+unique_bytes = sum(chunks.values())
+
+print()
+print(f"Urls:   {url_count} -> {sizeof_fmt(url_bytes)}")
+print(f"Files:  {len(files)} -> {sizeof_fmt(file_bytes)} whole-file ratio {url_bytes / max(file_bytes, 1):.2f}x")
+print(f"Chunks: {len(chunks)}/{chunk_count} unique -> {sizeof_fmt(unique_bytes)} chunk ratio {file_bytes / max(unique_bytes, 1):.2f}x")
+print(f"Total:  {url_bytes / max(unique_bytes, 1):.2f}x, chunked at {file_bytes / max(elapsed, 1e-9) / 1048576:.1f}MiB/s")
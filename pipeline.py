@@ -0,0 +1,105 @@
+import collections
+import concurrent.futures
+
+import api_helper
+
+class Stage:
+    # requests of one kind on their own threads, finished requests are handled on the main thread
+    # all stages share the api rate limiter, so workers bound parallelism rather than the request rate
+    def __init__(self, api, name, workers, handler=None):
+        self.api = api
+        self.name = name
+        self.workers = max(workers, 1)
+        self.engine = api_helper.Request_engine(api, self.workers)
+        self.handler = handler
+        self.pending = collections.deque()
+        self.handled = 0
+        self.failed = 0
+
+    def full(self):
+        return len(self.pending) >= self.workers
+
+    def futures(self):
+        return [p.future for _, p in self.pending if p.future is not None]
+
+    def poll(self):
+        # done requests leave the window before their handlers run, handlers may submit more work
+        done = [item for item in self.pending if item[1].done()]
+
+        for item in done:
+            self.pending.remove(item)
+
+        for context, p in done:
+            try:
+                data = p.result()
+            except Exception as e:
+                print(f'Request failed ({self.name}): ' + p.url)
+                print(e)
+                self.failed += 1
+                data = None
+
+            if self.handler:
+                self.handler(context, data)
+
+            self.handled += 1
+
+        return len(done)
+
+    def cancel(self):
+        for _, p in self.pending:
+            p.cancel()
+        self.pending.clear()
+
+class Pipeline:
+    def __init__(self, api):
+        self.api = api
+        self.stages = []
+
+    def stage(self, name, workers, handler=None):
+        stage = Stage(self.api, name, workers, handler)
+        self.stages.append(stage)
+        return stage
+
+    def submit(self, stage, context, url, write=True, use_local=False, time_diff=0, body=None):
+        # a full stage blocks the caller, the other stages keep draining meanwhile
+        while stage.full():
+            self.pump()
+
+        stage.pending.append((context, self.api.submit_json(url, write, use_local, time_diff, body, stage.engine)))
+
+    def pump(self, block=True):
+        progress = sum(stage.poll() for stage in self.stages)
+
+        if progress or not block:
+            return progress
+
+        futures = [future for stage in self.stages for future in stage.futures()]
+        if futures:
+            concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+
+        return sum(stage.poll() for stage in self.stages)
+
+    def busy(self):
+        return any(stage.pending for stage in self.stages)
+
+    def drain(self, interrupted=lambda: False):
+        while self.busy():
+            if interrupted():
+                self.cancel()
+                break
+            self.pump()
+
+        self.report()
+
+    def cancel(self):
+        for stage in self.stages:
+            stage.cancel()
+
+    def close(self):
+        for stage in self.stages:
+            stage.cancel()
+            stage.engine.shutdown()
+
+    def report(self):
+        for stage in self.stages:
+            print(f"Stage {stage.name}: {stage.handled} handled {stage.failed} failed {len(stage.pending)}/{stage.workers} in flight")
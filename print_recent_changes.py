@@ -1,14 +1,16 @@
 #!/bin/python3
 
-import json
 import sqlite3
 import importlib
 import os
 import datetime
 
 import config
+import json_codec
 import sqlite_helper as sqlh
 
+json_codec.set_codec(config.json_codec)
+
 db = sqlh.Sqlite_helper(config.db_filepath, dry_run=True)
 dbcur = db.con.cursor()
 
@@ -28,15 +30,12 @@ tablecur.execute("SELECT COUNT(*) FROM api")
 
 entry_count = tablecur.fetchone()[0]
 
-tablecur.execute("SELECT * FROM api")
-
 print(f"Processing {entry_count} records")
 
 counter = 0
 
-for api_raw in tablecur:
-    json_data = json.loads(api_raw[2])
-    time_point = api_raw[1]
+for url, time_point, json_raw in db.iterate_requests(tablecur):
+    json_data = json_codec.loads(json_raw)
 
     if counter % 5 == 0:
         print(f"\r{counter}/{entry_count}", end='', flush=True)
@@ -1,6 +1,5 @@
 #!/bin/python3
 
-import json
 import sqlite3
 import importlib
 import os
@@ -9,6 +8,9 @@ import datetime
 import sqlite_helper as sqlh
 import file_bucket as fileh
 import config
+import json_codec
+
+json_codec.set_codec(config.json_codec)
 
 def sizeof_fmt(num, suffix="B"):
     for unit in ("", "Ki", "Mi", "Gi", "Ti", "Pi", "Ei", "Zi"):
@@ -85,7 +87,7 @@ def save_primary_categories():
         open(source_dump_path, 'w') as source_dump):
         for row in db.cur:
             json_dump.write(f'{row[5]}\n')
-            json_data = json.loads(row[5])
+            json_data = json_codec.loads(row[5])
             classid = json_data['classId']
             links = json_data.get('links', None)
 
@@ -125,13 +127,10 @@ def approximate_file_count():
     ideal_file_count = 0
     api_entry_count = 0
 
-    db.cur.execute("SELECT * FROM api")
-
-    for api_raw in db.cur:
-        if 'files' in api_raw[0]:
-            json_data = json.loads(api_raw[2])
-            api_entry_count += 1
-            ideal_file_count += len(json_data['data'])
+    for url, time_point, json_raw in db.iterate_requests(db.cur, "WHERE instr(url, 'files') > 0"):
+        json_data = json_codec.loads(json_raw)
+        api_entry_count += 1
+        ideal_file_count += len(json_data['data'])
 
     print("Theoretical file count (JSON data of all API calls):", ideal_file_count)
     print("API entry count (URL search of all API calls):", api_entry_count)
@@ -158,12 +157,12 @@ def save_file_urls():
 
     with open(file_url_dump_path, 'w') as file_url_dump:
         for row in db.cur:
-            json_data = json.loads(row[5])
+            file_stub = json_codec.decode_file(row[5])
             
             file_url_count += 1
-            file_url_size += json_data["fileLength"]
+            file_url_size += file_stub.fileLength
 
-            file_url_dump.write(f'{json_data["id"]},{json_data["fileLength"]},{json_data["downloadUrl"]}\n')
+            file_url_dump.write(f'{file_stub.id},{file_stub.fileLength},{file_stub.downloadUrl}\n')
 
     print(f"File download URL count: {file_url_count} ({sizeof_fmt(file_url_size)})")
     scrape_info_dump.write(f"\nFile download URL count: {file_url_count} ({sizeof_fmt(file_url_size)})")
@@ -181,14 +180,14 @@ def save_all_urls():
         iter.execute("SELECT * FROM categories")
 
         for row in iter:
-            json_data = json.loads(row[4])
+            json_data = json_codec.loads(row[4])
             all_urls_dump.write(f"category,{json_data['id']},{json_data['slug']},iconUrl,,{json_data['iconUrl']}\n")
             all_url_count += 1
 
         iter.execute("SELECT * FROM games")
 
         for row in iter:
-            json_data = json.loads(row[3])
+            json_data = json_codec.loads(row[3])
             prefix = f"game,{json_data['id']},{json_data['slug']},"
             assets = json_data['assets']
             all_urls_dump.write(prefix + f"iconUrl,,{assets['iconUrl']}\n")
@@ -199,7 +198,7 @@ def save_all_urls():
         iter.execute("SELECT * FROM mods")
 
         for row in iter:
-            json_data = json.loads(row[5])
+            json_data = json_codec.loads(row[5])
             prefix = f"mod,{json_data['id']},{json_data['slug']},"
             logo = json_data['logo']
             for author in json_data['authors']:
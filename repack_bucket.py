@@ -0,0 +1,30 @@
+#!/bin/python3
+
+import os
+import sys
+
+import config
+import file_bucket_pack
+
+if not os.path.isfile(config.bucket_filepath):
+    print(f"Need path to bucket (from args: {config.bucket_filepath})")
+    sys.exit(1)
+
+bucket = file_bucket_pack.Filebucket(config.bucket_filepath, config.dry_run)
+
+def sizeof_fmt(num, suffix="B"):
+    for unit in ("", "Ki", "Mi", "Gi", "Ti", "Pi", "Ei", "Zi"):
+        if abs(num) < 1024.0:
+            return f"{num:3.1f}{unit}{suffix}"
+        num /= 1024.0
+    return f"{num:.1f}Yi{suffix}"
+
+with bucket.lock:
+    for pack, size, live in bucket.pack_usage():
+        print(f"Pack {pack}: {sizeof_fmt(live)} live of {sizeof_fmt(size)}")
+
+reclaimed = bucket.repack(config.repack_threshold)
+bucket.close()
+
+print(f"Reclaimed {sizeof_fmt(reclaimed)}")
+print("Done")
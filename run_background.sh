@@ -26,4 +26,7 @@ allcmd='--download-all'
 # maybe combine with compression of some kind, I won't be doing that though
 nocachecmd='--store-option=none --cache-option=none'
 
-$scrcmd '$nicecmd ./main.py -w 10000 $morecmd $waitformore' $runnow
\ No newline at end of file
+# or keep the cache compressed, train a dictionary first with ./compress_cache.py --cache-compression zstd --train-dictionary
+compresscmd='--cache-compression zstd'
+
+$scrcmd '$nicecmd ./main.py -w 10000 --max-rate 1 $morecmd $waitformore' $runnow
\ No newline at end of file
@@ -1,9 +1,73 @@
 import sqlite3
-import json
+import sys
+import time
+import re
+import hashlib
+import collections
+
+import compression
+import json_codec
+import time_helper
+
+class Request_cache:
+    # bounded lru of url -> (time, hash) for the newest stored response
+    def __init__(self, size=100000):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url):
+        entry = self.entries.get(url, False)
+
+        if entry is False:
+            self.misses += 1
+            return False
+
+        self.hits += 1
+        self.entries.move_to_end(url)
+        return entry
+
+    def peek(self, url):
+        # lookup without touching the order or the stats
+        return self.entries.get(url)
+
+    def put(self, url, entry):
+        if self.size <= 0:
+            return
+
+        self.entries[url] = entry
+        self.entries.move_to_end(url)
+
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0
+        return f'hits {self.hits} misses {self.misses} ({ratio:.1%}) entries {len(self.entries)}/{self.size}'
+
 
 class Sqlite_helper:
-    def __init__(self, file, dry_run=False):
+    def __init__(self, file, dry_run=False, cache_size=100000, compression='none', compression_level=None, synchronous='NORMAL', commit_rows=5000, commit_seconds=30):
         self.dry_run = dry_run
+        self.request_cache = Request_cache(cache_size)
+        self.compression = compression
+        self.compression_level = compression_level
+        self.compressors = dict()
+
+        # buffered writes, runs of [table, statement, rows] in queued order, flushed with executemany before reads of the same tables
+        self.synchronous = synchronous
+        self.batch_rows = 1000
+        self.commit_rows = commit_rows
+        self.commit_seconds = commit_seconds
+        self.pending = []
+        self.pending_tables = set()
+        self.pending_hashes = set()
+        self.pending_count = 0
+        self.uncommitted = 0
+        self.run_id = None
+        self.last_commit = time.time()
         
         self.load(file)
         self.init()
@@ -17,9 +81,227 @@ class Sqlite_helper:
         self.cur.execute('CREATE TABLE IF NOT EXISTS mods(id INTEGER PRIMARY KEY, name, slug, gameId, categoryIds, json)')
         self.cur.execute('CREATE TABLE IF NOT EXISTS files(id INTEGER PRIMARY KEY, displayName, fileName, gameId, modId, json)')
         self.cur.execute('CREATE TABLE IF NOT EXISTS api(url, time, json)')
+        self.cur.execute('CREATE TABLE IF NOT EXISTS schema_version(version INTEGER PRIMARY KEY, name, time)')
+
+        self.migrate()
+
+        self.write_codec = self.latest_codec(self.compression)
+
+    def schema_version(self):
+        self.cur.execute('SELECT MAX(version) FROM schema_version')
+        return self.cur.fetchone()[0] or 0
+
+    def migrations(self):
+        # (version, name, step), append only, steps run inside one transaction each
+        return [
+            (1, 'index api requests by url and time', self.migrate_api_index),
+            (2, 'per row compression codec for api requests', self.migrate_api_codec),
+            (3, 'deduplicate api responses by content hash', self.migrate_api_content),
+            (4, 'epoch timestamp columns for mods and files', self.migrate_epoch_columns),
+            (5, 'mod sync state for the stale mod planner', self.migrate_mod_sync_state),
+            (6, 'crawl runs and frontier checkpoints', self.migrate_crawl_frontier),
+            (7, 'mods seen by an unfinished crawl run', self.migrate_crawl_seen),
+        ]
+
+    def migrate(self):
+        version = self.schema_version()
+        latest = self.migrations()[-1][0]
+
+        # dry runs never write to disk, a schema upgrade needs one run without -n first
+        if self.dry_run and version < latest and self.file != ':memory:':
+            print(f'Database {self.file} is at schema version {version} of {latest}, run main.py once without -n to upgrade it')
+            sys.exit(1)
+
+        for target, name, step in self.migrations():
+            if target <= version:
+                continue
+
+            print(f'Migrating database to version {target}: {name}')
+            self.migrate_start = time.time()
+            self.migrate_report = self.migrate_start
+
+            if not self.con.in_transaction:
+                self.cur.execute('BEGIN')
+
+            self.con.set_progress_handler(self.migrate_progress, 100000)
+            try:
+                step()
+            finally:
+                self.con.set_progress_handler(None, 0)
+
+            self.cur.execute('INSERT INTO schema_version(version, name, time) VALUES(?,?,?)', (target, name, time.time()))
+
+            print("Commit to database:", self.file)
+            self.con.commit()
+            print(f'Migrated to version {target} in {time.time() - self.migrate_start:.3f}s')
+
+    def migrate_progress(self):
+        now = time.time()
+        if now - self.migrate_report > 5:
+            self.migrate_report = now
+            print(f'Migration running for {now - self.migrate_start:.0f}s', flush=True)
+        return 0
+
+    def migrate_api_index(self):
+        self.cur.execute('CREATE INDEX IF NOT EXISTS api_url_time ON api(url, time DESC)')
+
+    def migrate_api_codec(self):
+        # existing rows keep a NULL codec and stay plain json text
+        self.cur.execute('ALTER TABLE api ADD COLUMN codec')
+        self.cur.execute('CREATE TABLE IF NOT EXISTS api_dicts(id INTEGER PRIMARY KEY, codec, time, data)')
+
+    def migrate_api_content(self):
+        # api rows become (url, time, hash) pointers into api_content, stored bytes are moved as they are
+        self.cur.execute('ALTER TABLE api ADD COLUMN hash')
+        self.cur.execute('CREATE TABLE IF NOT EXISTS api_content(hash TEXT PRIMARY KEY, codec, json)')
+        self.cur.execute('DROP INDEX IF EXISTS api_url_time')
+        self.cur.execute('CREATE INDEX IF NOT EXISTS api_url_time_hash ON api(url, time DESC, hash)')
+
+        self.cur.execute('SELECT COUNT(*) FROM api')
+        total = self.cur.fetchone()[0]
+
+        cur = self.con.cursor()
+        last_rowid = 0
+        counter = 0
+        batch_size = 1000
+
+        while True:
+            cur.execute('SELECT rowid, json, codec FROM api WHERE rowid > ? ORDER BY rowid LIMIT ?', (last_rowid, batch_size))
+            rows = cur.fetchall()
+
+            if not rows:
+                break
+
+            for rowid, data, codec in rows:
+                if data is None:
+                    continue
+
+                hash = self.hash_request(self.decode_request(data, codec))
+                self.cur.execute('INSERT OR IGNORE INTO api_content(hash, codec, json) VALUES(?,?,?)', (hash, codec, data))
+                self.cur.execute('UPDATE api SET hash=?, json=NULL, codec=NULL WHERE rowid=?', (hash, rowid))
+
+            last_rowid = rows[-1][0]
+            counter += len(rows)
+            print(f'\rMoved {counter}/{total} requests', end='', flush=True)
+
+        if total:
+            print()
+
+    def migrate_epoch_columns(self):
+        self.cur.execute('ALTER TABLE mods ADD COLUMN dateModified INTEGER')
+        self.cur.execute('ALTER TABLE files ADD COLUMN fileDate INTEGER')
+
+        for table, column in [('mods', 'dateModified'), ('files', 'fileDate')]:
+            self.cur.execute(f'SELECT COUNT(*) FROM {table}')
+            total = self.cur.fetchone()[0]
+
+            cur = self.con.cursor()
+            last_id = -1
+            counter = 0
+
+            while True:
+                cur.execute(f'SELECT id, json FROM {table} WHERE id > ? ORDER BY id LIMIT 1000', (last_id,))
+                rows = cur.fetchall()
+
+                if not rows:
+                    break
+
+                updates = [(time_helper.parse_epoch(json_codec.loads(data).get(column)), id) for id, data in rows]
+                self.cur.executemany(f'UPDATE {table} SET {column}=? WHERE id=?', updates)
+
+                last_id = rows[-1][0]
+                counter += len(rows)
+                print(f'\rBackfilled {table}.{column} {counter}/{total}', end='', flush=True)
+
+            if total:
+                print()
+
+            self.cur.execute(f'CREATE INDEX IF NOT EXISTS {table}_{column} ON {table}({column})')
+
+    def migrate_mod_sync_state(self):
+        self.cur.execute('CREATE TABLE IF NOT EXISTS mod_sync_state(mod_id INTEGER PRIMARY KEY, upstream_modified INTEGER, files_fetched_at REAL NOT NULL DEFAULT 0)')
+        self.cur.execute('CREATE INDEX IF NOT EXISTS mod_sync_state_stale ON mod_sync_state(mod_id) WHERE upstream_modified > files_fetched_at')
+        self.cur.execute('INSERT OR IGNORE INTO mod_sync_state(mod_id, upstream_modified) SELECT id, dateModified FROM mods')
+
+        # newest files listing per mod, a range scan over the url index
+        reg = re.compile('^/mods/([0-9]+)/files\\?')
+        cur = self.con.cursor()
+        cur.execute("SELECT url, MAX(time) FROM api WHERE url >= '/mods/' AND url < '/mods0' GROUP BY url")
+
+        for url, fetched_at in cur:
+            match = reg.match(url)
+            if match:
+                self.cur.execute('UPDATE mod_sync_state SET files_fetched_at=MAX(files_fetched_at, ?) WHERE mod_id=?', (fetched_at, int(match.group(1))))
+
+    def migrate_crawl_frontier(self):
+        self.cur.execute('CREATE TABLE IF NOT EXISTS crawl_runs(id INTEGER PRIMARY KEY, started REAL, finished REAL)')
+        self.cur.execute('CREATE TABLE IF NOT EXISTS crawl_frontier(scope TEXT PRIMARY KEY, run_id INTEGER, phase TEXT, page_index INTEGER, last_id INTEGER, time REAL)')
+
+    def migrate_crawl_seen(self):
+        self.cur.execute('CREATE TABLE IF NOT EXISTS crawl_seen(run_id INTEGER, mod_id INTEGER, PRIMARY KEY(run_id, mod_id)) WITHOUT ROWID')
+
+    def hash_request(self, text:str):
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def latest_codec(self, codec):
+        # newest trained dictionary for the codec is used for writes
+        if codec in [None, 'none']:
+            return None
+
+        self.cur.execute('SELECT MAX(id) FROM api_dicts WHERE codec=?', (codec,))
+        return compression.format_codec(codec, self.cur.fetchone()[0])
+
+    def insert_dictionary(self, codec, data:bytes):
+        self.cur.execute('INSERT INTO api_dicts(codec, time, data) VALUES(?,?,?)', (codec, time.time(), data))
+        return self.cur.lastrowid
+
+    def get_compressor(self, name):
+        if name not in self.compressors:
+            codec, dict_id = compression.parse_codec(name)
+            dictionary = None
+
+            if dict_id is not None:
+                self.cur.execute('SELECT data FROM api_dicts WHERE id=?', (dict_id,))
+                dictionary = self.cur.fetchone()[0]
+
+            self.compressors[name] = compression.Compressor(codec, self.compression_level, dictionary)
+
+        return self.compressors[name]
+
+    def encode_request(self, text, codec=False):
+        # returns the stored value and codec name, text is kept as is without a codec
+        if codec is False:
+            codec = self.write_codec
+
+        if not codec:
+            return text.decode() if isinstance(text, bytes) else text, None
+
+        if isinstance(text, str):
+            text = text.encode()
+
+        return self.get_compressor(codec).compress(text), codec
+
+    def decode_request(self, data, codec):
+        if not codec:
+            return data
+
+        return self.get_compressor(codec).decompress(data).decode()
+
+    def iterate_requests(self, cur=None, where='', params=()):
+        # yields (url, time, json text) with compressed rows decoded
+        self.flush()
+
+        if cur is None:
+            cur = self.con.cursor()
+
+        cur.execute(f'SELECT api.url, api.time, api_content.json, api_content.codec FROM api INNER JOIN api_content ON api_content.hash=api.hash {where}', params)
+
+        for url, req_time, data, codec in cur:
+            yield url, req_time, self.decode_request(data, codec)
 
     def close(self):
         self.save()
+        print("Request cache:", self.request_cache.stats())
         print("Close connection")
         self.con.close()
 
@@ -33,7 +315,13 @@ class Sqlite_helper:
         self.con = sqlite3.connect(path)
         self.cur = self.con.cursor()
 
+        # wal lets report scripts read while a crawl is writing
+        self.cur.execute('PRAGMA journal_mode=WAL')
+        self.cur.execute(f'PRAGMA synchronous={self.synchronous}')
+
     def save(self):
+        self.flush()
+
         if not self.dry_run:
             print("Commit to database:", self.file)
             try:
@@ -41,34 +329,216 @@ class Sqlite_helper:
             except Exception as e:
                 print("Failed to commit:", e)
 
+        self.uncommitted = 0
+        self.last_commit = time.time()
+
+    def queue(self, table:str, sql:str, params):
+        # a row joins an earlier run of its statement unless another write to the same table was queued since
+        for run in reversed(self.pending):
+            if run[1] == sql:
+                run[2].append(params)
+                break
+            if run[0] == table:
+                self.pending.append([table, sql, [params]])
+                break
+        else:
+            self.pending.append([table, sql, [params]])
+
+        self.pending_tables.add(table)
+        self.pending_count += 1
+
+        if self.pending_count >= self.batch_rows:
+            self.flush()
+
+        self.maybe_commit()
+
+    def flush(self, table=None):
+        if not self.pending_count or (table is not None and table not in self.pending_tables):
+            return
+
+        # writes to one table keep their queued order, only writes to different tables are batched past each other
+        for table, sql, rows in self.pending:
+            self.cur.executemany(sql, rows)
+
+        self.uncommitted += self.pending_count
+        self.pending.clear()
+        self.pending_tables.clear()
+        self.pending_hashes.clear()
+        self.pending_count = 0
+
+    def maybe_commit(self):
+        if self.uncommitted + self.pending_count >= self.commit_rows or time.time() - self.last_commit >= self.commit_seconds:
+            self.save()
+
     def request_exists(self, url:str):
-        self.cur.execute('SELECT count(*) FROM api WHERE url=? LIMIT 1', (url,))
-        return self.cur.fetchone()[0] > 0
+        return self.last_request(url) is not None
+
+    def insert_request(self, url:str, json_data:dict, time):
+        self.insert_request_raw(url, json_codec.dumps(json_data).encode(), time)
+
+    def insert_request_raw(self, url:str, raw:bytes, time):
+        # response body as received, hashed and stored without parsing
+        hash = hashlib.sha1(raw).hexdigest()
+
+        # an unchanged response only costs the pointer row, a cache miss falls back to the content lookup rather than flushing the buffer
+        last = self.request_cache.peek(url)
+        if not (last and last[1] == hash) and not self.content_exists(hash):
+            data, codec = self.encode_request(raw)
+            self.queue('api_content', 'INSERT OR IGNORE INTO api_content(hash, codec, json) VALUES(?,?,?)', (hash, codec, data))
+            self.pending_hashes.add(hash)
+
+        self.request_cache.put(url, (time, hash))
+        self.queue('api', 'INSERT INTO api(url, time, hash) VALUES(?,?,?)', (url, time, hash))
+
+    def content_exists(self, hash:str):
+        if hash in self.pending_hashes:
+            return True
 
-    def insert_request(self, url:str, json_data:str, time):
-        self.cur.execute('INSERT OR REPLACE INTO api(url, json, time) VALUES(?,?,?)', (url, json.dumps(json_data), time))
+        self.cur.execute('SELECT 1 FROM api_content WHERE hash=?', (hash,))
+        return self.cur.fetchone() is not None
+
+    def last_request(self, url:str):
+        # (time, hash) of the newest stored response or None, memory first
+        entry = self.request_cache.get(url)
+
+        if entry is not False:
+            return entry
+
+        self.flush('api')
+        self.cur.execute('SELECT time, hash FROM api WHERE url=? ORDER BY time DESC LIMIT 1', (url,))
+        entry = self.cur.fetchone()
+        self.request_cache.put(url, entry)
+        return entry
+
+    def when_last_request(self, url:str):
+        entry = self.last_request(url)
+        return entry[0] if entry else 0
+
+    def get_content(self, hash:str):
+        if hash in self.pending_hashes:
+            self.flush()
+
+        self.cur.execute('SELECT json, codec FROM api_content WHERE hash=?', (hash,))
+        return self.decode_request(*self.cur.fetchone())
 
     def get_request(self, url:str):
-        self.cur.execute('SELECT json FROM api WHERE url=? ORDER BY time LIMIT 1', (url,))
-        return self.cur.fetchone()[0]
+        return self.get_content(self.last_request(url)[1])
     
     def table_exists(self, table:str):
         self.cur.execute("SELECT count(*) FROM sqlite_master WHERE type='table' AND name=? LIMIT 1", (table,))
         return self.cur.fetchone()[0] > 0
 
     def field_exists(self, table:str, id:int):
+        self.flush(table)
         self.cur.execute(f'SELECT count(*) FROM {table} WHERE id=? LIMIT 1', (id,))
         return self.cur.fetchone()[0] > 0
 
-    def insert_category(self, category:dict):
-        self.cur.execute('INSERT OR REPLACE INTO categories(id, name, slug, gameId, json) VALUES(?,?,?,?,?)', (category['id'], category['name'], category['slug'], category['gameId'], json.dumps(category)))
+    # raw is the stub's source text from the response page, it is stored as is instead of dumping the dict again
+
+    def insert_category(self, category:dict, raw:str=None):
+        self.queue('categories', 'INSERT OR REPLACE INTO categories(id, name, slug, gameId, json) VALUES(?,?,?,?,?)', (category['id'], category['name'], category['slug'], category['gameId'], raw or json_codec.dumps(category)))
+
+    def insert_game(self, game:dict, raw:str=None):
+        self.queue('games', 'INSERT OR REPLACE INTO games(id, name, slug, json) VALUES(?,?,?,?)', (game['id'], game['name'], game['slug'], raw or json_codec.dumps(game)))
+
+    def insert_mod(self, mod:dict, raw:str=None):
+        categoryIds = json_codec.dumps([x['id'] for x in mod['categories']])
+        dateModified = time_helper.parse_epoch(mod['dateModified'])
+        self.queue('mods', 'INSERT OR REPLACE INTO mods(id, name, slug, gameId, categoryIds, dateModified, json) VALUES(?,?,?,?,?,?,?)', (mod['id'], mod['name'], mod['slug'], mod['gameId'], categoryIds, dateModified, raw or json_codec.dumps(mod)))
+        self.queue('mod_sync_state', 'INSERT INTO mod_sync_state(mod_id, upstream_modified) VALUES(?,?) ON CONFLICT(mod_id) DO UPDATE SET upstream_modified=excluded.upstream_modified', (mod['id'], dateModified))
+
+    def stale_filter(self, full=False, listed=None):
+        # listed selects mods whose files were listed before (True) or never (False), None takes both
+        stale = '' if full else 'upstream_modified > files_fetched_at AND'
+
+        if listed is True:
+            stale += ' files_fetched_at > 0 AND'
+        elif listed is False:
+            stale += ' files_fetched_at = 0 AND'
+
+        return stale
+
+    def count_stale_mods(self, full=False, listed=None):
+        self.flush()
+        self.cur.execute(f'SELECT COUNT(*) FROM mod_sync_state WHERE {self.stale_filter(full, listed)} 1')
+        return self.cur.fetchone()[0]
+
+    def iterate_stale_mods(self, full=False, batch_size=500, last_id=-1, listed=None):
+        # yields (id, json, dateModified, files_fetched_at), keyset paging keeps memory bounded while rows are marked
+        stale = self.stale_filter(full, listed)
+        cur = self.con.cursor()
+
+        while True:
+            self.flush()
+            cur.execute(f'SELECT mods.id, mods.json, mods.dateModified, mod_sync_state.files_fetched_at FROM mod_sync_state INNER JOIN mods ON mods.id=mod_sync_state.mod_id WHERE {stale} mod_sync_state.mod_id > ? ORDER BY mod_sync_state.mod_id LIMIT ?', (last_id, batch_size))
+            rows = cur.fetchall()
+
+            if not rows:
+                return
+
+            yield from rows
+            last_id = rows[-1][0]
+
+    def mark_files_fetched(self, mod_id:int, time):
+        self.queue('mod_sync_state', 'UPDATE mod_sync_state SET files_fetched_at=? WHERE mod_id=?', (time, mod_id))
+
+    def start_run(self, max_age):
+        # an unfinished run younger than max_age is resumed with its frontier, otherwise the frontier starts empty
+        self.flush()
+        self.cur.execute('SELECT id, started FROM crawl_runs WHERE finished IS NULL ORDER BY id DESC LIMIT 1')
+        row = self.cur.fetchone()
+
+        if row and row[1] > time.time() - max_age:
+            self.run_id = row[0]
+            return True
+
+        if row:
+            print(f'Crawl run {row[0]} is older than {max_age}s, starting over')
+
+        self.cur.execute('DELETE FROM crawl_frontier')
+        self.cur.execute('DELETE FROM crawl_seen')
+        self.cur.execute('INSERT INTO crawl_runs(started) VALUES(?)', (time.time(),))
+        self.run_id = self.cur.lastrowid
+        return False
+
+    def finish_run(self):
+        self.queue('crawl_runs', 'UPDATE crawl_runs SET finished=? WHERE id=?', (time.time(), self.run_id))
+        self.queue('crawl_frontier', 'DELETE FROM crawl_frontier WHERE run_id=?', (self.run_id,))
+        self.queue('crawl_seen', 'DELETE FROM crawl_seen WHERE run_id=?', (self.run_id,))
+
+    def checkpoint(self, scope:str, phase:str, page_index:int=None, last_id:int=None):
+        # queued behind the rows it covers, a commit never holds the checkpoint without its data
+        self.queue('crawl_frontier', 'INSERT OR REPLACE INTO crawl_frontier(scope, run_id, phase, page_index, last_id, time) VALUES(?,?,?,?,?,?)', (scope, self.run_id, phase, page_index, last_id, time.time()))
+
+    def get_checkpoint(self, scope:str):
+        # (phase, page_index, last_id) or None
+        self.flush('crawl_frontier')
+        self.cur.execute('SELECT phase, page_index, last_id FROM crawl_frontier WHERE scope=? AND run_id=?', (scope, self.run_id))
+        return self.cur.fetchone()
+
+    def mark_seen(self, ids:list):
+        for id in ids:
+            self.queue('crawl_seen', 'INSERT OR IGNORE INTO crawl_seen(run_id, mod_id) VALUES(?,?)', (self.run_id, id))
+
+    def get_seen(self):
+        self.flush('crawl_seen')
+        self.cur.execute('SELECT mod_id FROM crawl_seen WHERE run_id=?', (self.run_id,))
+        return {row[0] for row in self.cur.fetchall()}
 
-    def insert_game(self, game:dict):
-        self.cur.execute('INSERT OR REPLACE INTO games(id, name, slug, json) VALUES(?,?,?,?)', (game['id'], game['name'], game['slug'], json.dumps(game)))
+    def get_mod_times(self, ids:list):
+        # id -> stored dateModified for the known ids, one query per search page
+        self.flush('mods')
+        placeholders = ','.join('?' * len(ids))
+        self.cur.execute(f'SELECT id, dateModified FROM mods WHERE id IN ({placeholders})', ids)
+        return dict(self.cur.fetchall())
 
-    def insert_mod(self, mod:dict):
-        categoryIds = json.dumps([x['id'] for x in mod['categories']])
-        self.cur.execute('INSERT OR REPLACE INTO mods(id, name, slug, gameId, categoryIds, json) VALUES(?,?,?,?,?,?)', (mod['id'], mod['name'], mod['slug'], mod['gameId'], categoryIds, json.dumps(mod)))
+    def get_files_fetched(self, ids:list):
+        # id -> files_fetched_at for the known ids, 0 when their files were never listed
+        self.flush('mod_sync_state')
+        placeholders = ','.join('?' * len(ids))
+        self.cur.execute(f'SELECT mod_id, files_fetched_at FROM mod_sync_state WHERE mod_id IN ({placeholders})', ids)
+        return dict(self.cur.fetchall())
         
-    def insert_file(self, file:dict):
-        self.cur.execute('INSERT OR REPLACE INTO files(id, displayName, fileName, gameId, modId, json) VALUES(?,?,?,?,?,?)', (file['id'], file['displayName'], file['fileName'], file['gameId'], file['modId'], json.dumps(file)))
\ No newline at end of file
+    def insert_file(self, file:dict, raw:str=None):
+        fileDate = time_helper.parse_epoch(file['fileDate'])
+        self.queue('files', 'INSERT OR REPLACE INTO files(id, displayName, fileName, gameId, modId, fileDate, json) VALUES(?,?,?,?,?,?,?)', (file['id'], file['displayName'], file['fileName'], file['gameId'], file['modId'], fileDate, raw or json_codec.dumps(file)))
\ No newline at end of file
@@ -0,0 +1,184 @@
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+# a stand-in for the curseforge api, mods start with three files and list the newest as their latest file
+# modified times are epoch seconds, an update is newer than any earlier crawl
+# files pages are newest first like the real api, file ids are mod id * 1000 + upload number
+
+def stamp(epoch):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(epoch))
+
+class Api_state:
+    def __init__(self, count):
+        old = int(time.time()) - 86400 * 30
+        self.mods = {id: old for id in range(1000, 1000 + count)}
+        self.files = {id: [old] * 3 for id in self.mods}
+        self.hits = []
+
+    def mod(self, id):
+        latest = id * 1000 + len(self.files[id]) - 1
+        return {'id': id, 'name': f'm{id}', 'slug': f's{id}', 'gameId': 432, 'categories': [{'id': 1}], 'dateModified': stamp(self.mods[id]),
+                'logo': None, 'screenshots': [], 'authors': [], 'latestFilesIndexes': [{'fileId': latest}]}
+
+    def file(self, id):
+        return {'id': id, 'displayName': f'f{id}', 'fileName': f'f{id}.jar', 'gameId': 432, 'modId': id // 1000,
+                'fileDate': stamp(self.files[id // 1000][id % 1000]), 'downloadUrl': '', 'fileLength': 0, 'hashes': []}
+
+    def update(self, id, uploads=1, old=0):
+        # several uploads for the same game version leave only the newest in latestFilesIndexes
+        self.mods[id] = int(time.time())
+        self.files[id] = self.files.get(id, []) + [int(time.time()) - 86400 * 30] * old + [int(time.time())] * uploads
+
+def page(data, index, total):
+    return {'data': data, 'pagination': {'index': index, 'pageSize': 50, 'resultCount': len(data), 'totalCount': total}}
+
+def handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def send(self, body):
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            index = int(query.get('index', ['0'])[0])
+            state.hits.append(('GET', url.path, index))
+
+            if url.path == '/games':
+                return self.send(page([{'id': 432, 'name': 'g', 'slug': 'g', 'dateModified': '2024-01-01T00:00:00Z', 'assets': None}], 0, 1))
+
+            if url.path == '/categories':
+                return self.send(page([{'id': 1, 'name': 'c', 'slug': 'c', 'gameId': 432, 'dateModified': '2024-01-01T00:00:00Z', 'iconUrl': ''}], 0, 1))
+
+            if url.path == '/mods/search':
+                ids = sorted(state.mods, key=lambda id: (-state.mods[id], id))
+                return self.send(page([state.mod(id) for id in ids[index:index + 50]], index, len(ids)))
+
+            match = re.match(r'^/mods/(\d+)/files$', url.path)
+            if match:
+                id = int(match.group(1))
+                ids = [id * 1000 + k for k in reversed(range(len(state.files[id])))]
+                return self.send(page([state.file(file_id) for file_id in ids[index:index + 50]], index, len(ids)))
+
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            state.hits.append(('POST', self.path, len(body.get('modIds') or body.get('fileIds'))))
+
+            if self.path == '/mods':
+                return self.send({'data': [state.mod(id) for id in body['modIds']]})
+
+            return self.send({'data': [state.file(id) for id in body['fileIds']]})
+
+    return Handler
+
+@pytest.fixture
+def api():
+    state = Api_state(120)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state.url = f'http://127.0.0.1:{server.server_address[1]}'
+    yield state
+    server.shutdown()
+
+def crawl(api, path, *args):
+    api.hits.clear()
+    command = [sys.executable, MAIN, '-k', 'x', '-u', api.url, '-o', str(path), '-w', '1', '--batch-size', '50', '--cache-option', 'none', '--pid-file', str(path / 'curse.pid'), *args]
+    result = subprocess.run(command, cwd=path, capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stdout + result.stderr
+
+    con = sqlite3.connect(path / 'curseforge.db')
+    stale = con.execute('SELECT COUNT(*) FROM mod_sync_state WHERE upstream_modified > files_fetched_at').fetchone()[0]
+    files = {row[0] for row in con.execute('SELECT id FROM files')}
+    con.close()
+    return stale, files
+
+def file_listings(api):
+    return [(path, index) for method, path, index in api.hits if method == 'GET' and path.endswith('/files')]
+
+def posts(api, path):
+    return [count for method, hit, count in api.hits if method == 'POST' and hit == path]
+
+def uploads(id, count):
+    return {id * 1000 + k for k in range(count)}
+
+@pytest.mark.parametrize('mode', [[], ['--pipeline']])
+def test_changed_mods_refresh_in_bulk(api, tmp_path, mode):
+    api.update(1119, old=117)
+    stale, files = crawl(api, tmp_path, *mode)
+
+    # a new mod has every files page listed once
+    assert stale == 0
+    assert len(files) == 360 + 118
+    assert len(file_listings(api)) == 120 + 2
+    assert not posts(api, '/mods/files')
+
+    # dates have second resolution, updates must land after the previous listing
+    time.sleep(1)
+
+    for id in range(1000, 1030):
+        api.update(id)
+    api.update(1030, uploads=2)
+    api.update(1119)
+    api.update(2000, uploads=3)
+
+    stale, files = crawl(api, tmp_path, *mode)
+
+    # changed mods get their latest file in bulk and list files only back to the previous crawl
+    assert stale == 0
+    assert posts(api, '/mods/files') == [32]
+    assert not posts(api, '/mods')
+    assert ('/mods/1119/files', 0) in file_listings(api)
+    assert ('/mods/1119/files', 50) not in file_listings(api)
+    assert ('/mods/2000/files', 0) in file_listings(api)
+    assert len(file_listings(api)) == 33
+
+    # the upload that is no longer the latest file comes from the files page
+    assert set().union(*(uploads(id, 4) for id in range(1000, 1030))) <= files
+    assert uploads(1030, 5) <= files
+    assert uploads(1119, 122) <= files
+    assert uploads(2000, 3) <= files
+
+def test_unseen_stale_mods_refresh_stubs(api, tmp_path):
+    crawl(api, tmp_path)
+    time.sleep(1)
+
+    for id in range(1000, 1060):
+        api.update(id)
+
+    con = sqlite3.connect(tmp_path / 'curseforge.db')
+    con.execute('UPDATE mod_sync_state SET files_fetched_at=1 WHERE mod_id < 1060')
+    con.commit()
+    con.close()
+
+    stale, files = crawl(api, tmp_path, '--skip', 'category_iterate')
+
+    # stubs missing from this run's search pages come from the bulk mods endpoint, 60 ids in batches of 50
+    assert stale == 0
+    assert posts(api, '/mods') == [50, 10]
+    assert posts(api, '/mods/files') == [50, 10]
+    assert len(file_listings(api)) == 60
+    assert set().union(*(uploads(id, 4) for id in range(1000, 1060))) <= files
@@ -0,0 +1,29 @@
+import io
+import hashlib
+
+import pytest
+
+import file_bucket
+
+@pytest.fixture
+def bucket(tmp_path):
+    bucket = file_bucket.Filebucket(str(tmp_path / 'bucket.db'))
+    yield bucket
+    bucket.close()
+
+def test_known_hash_matches_text_length(bucket):
+    # rows written from a Content-Length header keep the length as text
+    data = b'known' * 100
+    hash = hashlib.md5(data).hexdigest()
+    bucket.cur.execute('INSERT INTO files(hash, length, filename, time, data) VALUES(?, ?, ?, ?, ?)', (hash, str(len(data)), 'old.jar', 1, data))
+
+    assert bucket.find_known_hash([{'algo': 2, 'value': hash.upper()}], len(data)) == (hash, len(data))
+    assert bucket.find_known_hash([{'algo': 2, 'value': hash}], len(data) + 1) == (None, None)
+
+def test_known_hash_skips_download(bucket):
+    data = b'stored' * 100
+    hash = hashlib.md5(data).hexdigest()
+    bucket.insert_stream('/a', io.BytesIO(data), len(data), 1, 1, 'a.jar')
+    bucket.try_insert_url('/b', 1, len(data), 2, 'b.jar', [{'algo': 1, 'value': 'x'}, {'algo': 2, 'value': hash}])
+
+    assert bucket.url_exists('/b')
@@ -0,0 +1,105 @@
+import io
+import os
+import hashlib
+import threading
+
+import pytest
+
+import file_bucket_filesystem
+
+@pytest.fixture
+def bucket(tmp_path):
+    bucket = file_bucket_filesystem.Filebucket(str(tmp_path / 'bucket.db'))
+    yield bucket
+    bucket.close()
+
+def md5(data):
+    return hashlib.md5(data).hexdigest()
+
+def stored(bucket, hash):
+    with bucket.get_stream(hash) as stream:
+        return stream.read()
+
+def test_layout(bucket, tmp_path):
+    data = b'layout' * 1000
+    bucket.insert_stream('/a', io.BytesIO(data), len(data), 1, 7, 'mod.jar')
+
+    hash = md5(data)
+    name = f'{hash} 7.jar'
+    path = tmp_path / 'bucket' / 'objects' / name[0:2] / name[2:4] / name
+
+    assert path.read_bytes() == data
+    assert bucket.get_filesystem_path(hash) == str(path)
+    assert os.listdir(tmp_path / 'bucket' / 'stage') == []
+
+def test_round_trip_without_length(bucket):
+    data = os.urandom(3 * 65536 + 5)
+    bucket.insert_stream('/a', io.BytesIO(data))
+
+    assert stored(bucket, md5(data)) == data
+    assert bucket.url_exists('/a')
+
+def test_same_hash_hardlinks(bucket):
+    data = b'shared' * 1000
+    bucket.insert_stream('/a', io.BytesIO(data), len(data), 1, 1, 'one.jar')
+    bucket.insert_stream('/b', io.BytesIO(data), len(data), 1, 2, 'two.zip')
+
+    hash = md5(data)
+    first = bucket.object_path(f'{hash} 1.jar')
+    second = bucket.object_path(f'{hash} 2.zip')
+
+    assert os.path.samefile(first, second)
+    assert os.stat(first).st_nlink == 2
+
+    bucket.cur.execute('SELECT COUNT(*) FROM files WHERE hash=?', (hash,))
+    assert bucket.cur.fetchone()[0] == 1
+    bucket.cur.execute('SELECT COUNT(*) FROM api WHERE hash=?', (hash,))
+    assert bucket.cur.fetchone()[0] == 2
+
+def test_short_stream_is_cleaned_up(bucket, tmp_path):
+    data = b'short'
+
+    with pytest.raises(ValueError):
+        bucket.insert_stream('/a', io.BytesIO(data), len(data) + 10)
+
+    assert os.listdir(tmp_path / 'bucket' / 'stage') == []
+    assert not bucket.url_exists('/a')
+    assert not bucket.hash_exists(md5(data))
+
+def test_concurrent_inserts_stage_uniquely(bucket, tmp_path):
+    # half the threads write the same content, staging names must never collide
+    contents = [os.urandom(200000) for _ in range(8)] + [b'same' * 50000] * 8
+    errors = []
+
+    def insert(i, data):
+        try:
+            bucket.insert_stream(f'/{i}', io.BytesIO(data), len(data), 1, i, f'{i}.jar')
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=insert, args=(i, data)) for i, data in enumerate(contents)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert os.listdir(tmp_path / 'bucket' / 'stage') == []
+
+    for i, data in enumerate(contents):
+        assert bucket.url_exists(f'/{i}')
+        assert stored(bucket, md5(data)) == data
+
+    bucket.cur.execute('SELECT COUNT(*) FROM files')
+    assert bucket.cur.fetchone()[0] == 9
+
+def test_memory_bucket_stays_out_of_cwd(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bucket = file_bucket_filesystem.Filebucket(':memory:')
+    data = b'memory'
+    bucket.insert_stream('/a', io.BytesIO(data), len(data))
+
+    assert stored(bucket, md5(data)) == data
+    assert os.listdir(tmp_path) == []
+    bucket.close()
+    assert not os.path.exists(bucket.root)
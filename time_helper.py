@@ -0,0 +1,20 @@
+import calendar
+import functools
+
+# curseforge timestamps are utc, '2024-01-02T03:04:05.123Z' or '2024-01-02T03:04:05Z'
+@functools.lru_cache(maxsize=65536)
+def parse_time(stime):
+    try:
+        seconds = calendar.timegm((int(stime[0:4]), int(stime[5:7]), int(stime[8:10]), int(stime[11:13]), int(stime[14:16]), int(stime[17:19]), 0, 0, 0))
+    except (TypeError, ValueError, IndexError):
+        return 0
+
+    if len(stime) > 20 and stime[19] == '.':
+        fraction = stime[20:].rstrip('Z')
+        if fraction.isdigit():
+            seconds += int(fraction) / 10 ** len(fraction)
+
+    return seconds
+
+def parse_epoch(stime):
+    return int(parse_time(stime))